@@ -1,25 +1,45 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from pydantic import BaseModel, ValidationError
 from typing import List, Optional
-from utils.db import get_data
-from utils.chat import get_response_from_llm
-from utils.utils import preprocess_tiktok_data, analyze_hashtags, extract_json_from_text
-from rag.chunk import create_chunks_from_df, upsert_embeddings_to_pinecone, query_pinecone, rerank_results, get_full_contexts
-from utils.prompts import PROMPT, SUMMARY_GUIDE
+from contextlib import asynccontextmanager
+from utils.db import get_data, stream_data, get_snapshot_version, init_pool, close_pool, get_pool_stats
+from utils.chat import get_response_from_llm_async, stream_response_from_llm_async, get_async_client, get_llm_cache_stats
+from utils.utils import preprocess_tiktok_data, analyze_hashtags, extract_json_from_text, JSONArrayStreamParser, get_comment_cache_stats, filter_languages, shutdown_executors
+from utils.offline_task import load_precomputed
+from rag.chunk import vector_store, embedding_cache, create_chunks_from_df, ChunkBuilder, upsert_embeddings_to_pinecone, query_pinecone, build_filter, rerank_union, log_normalized_likes, ParentIndex
+from rag.pack import pack_contexts, shard_contexts
+from rag.dedup import collapse_near_duplicates
+from rag.lexical import get_lexical_index, hybrid_results
+from utils.cache import DiskCache
+from utils.singleflight import SingleFlight
+from utils.metrics import stage, record_stage, record_items, request_timings, server_timing, render as render_metrics, collectors
+from utils.prompts import PROMPT, SUMMARY_GUIDE, SHARD_PROMPT, REDUCE_PROMPT
 import openai
 import json
 import asyncio
 import os
 import re
 import ast
+import time
+import hashlib
 from dotenv import load_dotenv
 import numpy as np
 import pandas as pd
 
 load_dotenv()
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One Postgres pool for the lifetime of the app (DB_POOL_MIN_SIZE/DB_POOL_MAX_SIZE)
+    await init_pool()
+    yield
+    await close_pool()
+    # Worker pools started by filter_languages
+    await asyncio.to_thread(shutdown_executors)
+
+app = FastAPI(lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -30,9 +50,28 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
+# Server-Timing header with per-stage durations: always when TIMING_HEADER=1,
+# otherwise only for requests sending "X-Timing: 1"
+TIMING_HEADER = os.getenv('TIMING_HEADER', '0') == '1'
+
+@app.middleware("http")
+async def timing_middleware(request: Request, call_next):
+    timings = {}
+    token = request_timings.set(timings)
+    try:
+        response = await call_next(request)
+    finally:
+        request_timings.reset(token)
+    if timings and (TIMING_HEADER or request.headers.get("x-timing") == "1"):
+        response.headers["Server-Timing"] = server_timing(timings)
+    return response
+
 class GenerateRequest(BaseModel):
     keyword: str
     hashtags: Optional[List[str]] = []
+    # False runs the whole pipeline afresh: no result cache lookup or write,
+    # no sharing with identical in-flight requests, no LLM response cache
+    use_cache: bool = True
 
 class Scenario(BaseModel):
     scenario: str
@@ -43,20 +82,98 @@ class Scenario(BaseModel):
 class GenerateResponse(BaseModel):
     scenarios: List[Scenario]
 
+# Prompt tokens available for retrieved contexts
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', '20000'))
+
+# GENERATION_MODE=map_reduce extracts findings from context shards in
+# parallel (SHARD_MODEL, SHARD_TOKEN_BUDGET tokens each, at most MAX_SHARDS)
+# and merges them into scenarios with one reduce call
+GENERATION_MODE = os.getenv('GENERATION_MODE', 'single')
+SHARD_TOKEN_BUDGET = int(os.getenv('SHARD_TOKEN_BUDGET', '8000'))
+MAX_SHARDS = int(os.getenv('MAX_SHARDS', '8'))
+SHARD_MODEL = os.getenv('SHARD_MODEL', 'gpt-4o-mini-2024-07-18')
+
+# /generate results keyed by (keyword, hashtags, data snapshot) and the
+# settings that shape the answer (result_settings); RESULT_CACHE_PATH=
+# disables it
+RESULT_CACHE_PATH = os.getenv('RESULT_CACHE_PATH', '.cache/results.sqlite')
+result_cache = DiskCache(
+    RESULT_CACHE_PATH,
+    max_entries=int(os.getenv('RESULT_CACHE_MAX_ENTRIES', '1000')),
+    ttl=float(os.getenv('RESULT_CACHE_TTL', str(24 * 3600))),
+) if RESULT_CACHE_PATH else None
+generate_flight = SingleFlight()
+
+# Retrieval is scoped inside the vector store to the request's hashtags and,
+# optionally, to chunk levels (e.g. comment,reply) and a minimum like bucket
+# (order of magnitude of likes). RETRIEVAL_SCOPED=0 searches the whole index.
+RETRIEVAL_TOP_K = int(os.getenv('RETRIEVAL_TOP_K', '400'))
+RETRIEVAL_SCOPED = os.getenv('RETRIEVAL_SCOPED', '1') == '1'
+RETRIEVAL_LEVELS = [l.strip() for l in os.getenv('RETRIEVAL_LEVELS', '').split(',') if l.strip()]
+RETRIEVAL_MIN_LIKE_BUCKET = int(os.getenv('RETRIEVAL_MIN_LIKE_BUCKET', '0'))
+# "hybrid" fuses vector search with BM25 over the chunk set (rag/lexical.py),
+# "dense" only searches vectors and "lexical" only BM25, which skips the
+# embeddings API entirely (no upsert, no query embeddings). Hybrid falls back
+# to lexical results when embedding fails.
+RETRIEVAL_MODE = os.getenv('RETRIEVAL_MODE', 'hybrid')
+# Chunks kept after fusing the matches of every rephrased query; only these
+# get their contexts rebuilt and are offered to the context packer
+RERANK_TOP_N = int(os.getenv('RERANK_TOP_N', '1000'))
+
+# Rows per server-side cursor batch when ingesting; 0 loads everything at once
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', '5000'))
+
+async def load_chunks(hashtags: List[str]) -> pd.DataFrame:
+    if not INGEST_BATCH_SIZE:
+        with stage("get_data"):
+            raw_data = await get_data(hashtags)
+        with stage("create_chunks_from_df"):
+            chunks_df = await asyncio.to_thread(create_chunks_from_df, raw_data)
+    else:
+        # Fetching and chunking interleave; time them separately
+        builder = ChunkBuilder()
+        fetch_seconds = chunk_seconds = 0.0
+        rows = 0
+        start = time.perf_counter()
+        async for batch in stream_data(hashtags, batch_size=INGEST_BATCH_SIZE):
+            fetched = time.perf_counter()
+            fetch_seconds += fetched - start
+            await asyncio.to_thread(builder.add, batch)
+            rows += len(batch)
+            start = time.perf_counter()
+            chunk_seconds += start - fetched
+        fetch_seconds += time.perf_counter() - start
+        chunks_df = await asyncio.to_thread(builder.result)
+        record_stage("get_data", fetch_seconds)
+        record_stage("create_chunks_from_df", chunk_seconds)
+        record_items("get_data", "rows", rows)
+    record_items("create_chunks_from_df", "chunks", len(chunks_df))
+    # Comments in other languages are dropped before anything is embedded
+    with stage("filter_languages"):
+        filtered_df = await asyncio.to_thread(filter_languages, chunks_df)
+    record_items("filter_languages", "dropped", len(chunks_df) - len(filtered_df))
+    # Near-duplicate comments are embedded and prompted once, with summed likes
+    with stage("collapse_near_duplicates"):
+        collapsed_df = await asyncio.to_thread(collapse_near_duplicates, filtered_df)
+    record_items("collapse_near_duplicates", "dropped", len(filtered_df) - len(collapsed_df))
+    return collapsed_df
+
 async def query_rephrase(
     query: str,
     model: str,
-    client: openai.OpenAI,
-    msg_history: List = []
+    client: openai.AsyncOpenAI,
+    msg_history: List = [],
+    use_cache: bool = True
 ) -> Optional[List[str]]:
     try:
         prompt = SUMMARY_GUIDE.format(query=query)
-        text, msg_history = get_response_from_llm(
+        text, msg_history = await get_response_from_llm_async(
             msg=prompt,
             client=client,
             model=model,
             msg_history=msg_history,
-            system_message="You are a helpful and smart assistant"
+            system_message="You are a helpful and smart assistant",
+            use_cache=use_cache
         )
         
         query_content_match = re.search(r'<query>\s*(.*?)\s*</query>', text, re.DOTALL)
@@ -77,69 +194,200 @@ async def query_rephrase(
 
 async def generate_scenarios(
     save_dir: str,
-    reviews: pd.DataFrame,
+    reviews: str,
     keyword: str,
-    client: openai.OpenAI,
+    client: openai.AsyncOpenAI,
     model: str,
     assess: bool = False,
     results: Optional[dict] = None,
-    msg_history: List = []
+    msg_history: List = [],
+    prompt_template: str = PROMPT,
+    use_cache: bool = True
 ) -> Optional[str]:
     try:
         if not assess:
-            prompt = PROMPT.format(
+            prompt = prompt_template.format(
                 keyword=keyword,
                 reviews=reviews
             )
-        text, msg_history = get_response_from_llm(
+        text, msg_history = await get_response_from_llm_async(
             prompt,
             client=client,
             model=model,
             msg_history=msg_history,
-            system_message="You are a helpful and smart assistant"
+            system_message="You are a helpful and smart assistant",
+            use_cache=use_cache
         )
         return text
     except Exception as e:
         print(f"Failed to generate: {e}")
         return None
 
-@app.post("/generate", response_model=GenerateResponse)
-async def generate(request: GenerateRequest):
-    print(request)
+async def stream_scenarios(
+    reviews: str,
+    keyword: str,
+    client: openai.AsyncOpenAI,
+    model: str,
+    msg_history: List = [],
+    prompt_template: str = PROMPT,
+    use_cache: bool = True
+):
+    # Streaming variant of generate_scenarios: yields text deltas
+    prompt = prompt_template.format(
+        keyword=keyword,
+        reviews=reviews
+    )
+    async for delta in stream_response_from_llm_async(
+        prompt,
+        client=client,
+        model=model,
+        msg_history=msg_history,
+        system_message="You are a helpful and smart assistant",
+        use_cache=use_cache
+    ):
+        yield delta
+
+async def extract_shard_findings(
+    shards: List[str],
+    keyword: str,
+    client: Optional[openai.AsyncOpenAI],
+    model: str,
+    use_cache: bool = True
+) -> List[str]:
+    # Map step: one findings-extraction call per shard, all in flight at once
+    async def extract(reviews):
+        try:
+            text, _ = await get_response_from_llm_async(
+                SHARD_PROMPT.format(keyword=keyword, reviews=reviews),
+                client=client,
+                model=model,
+                system_message="You are a helpful and smart assistant",
+                use_cache=use_cache
+            )
+            return text
+        except Exception as e:
+            print(f"Failed to extract shard findings: {e}")
+            return None
+
+    findings = await asyncio.gather(*[extract(reviews) for reviews in shards])
+    return [f for f in findings if f]
+
+def rerank(results, chunks_df):
+    # CPU-bound; run_pipeline calls it in a worker thread
+    parent_index = ParentIndex(chunks_df)
+    return parent_index, rerank_union(results, chunks_df, parent_index, top_n=RERANK_TOP_N)
+
+async def run_pipeline(request: GenerateRequest, emit=None) -> GenerateResponse:
+    # Shared by /generate and /generate/stream. When emit is given it is
+    # awaited with (event, data) for every stage transition and for each
+    # scenario as soon as it has been generated.
     client_model = "gpt-4o-2024-05-13"
-    client = openai.OpenAI()
-    
-    # Step 0: Get data from postgres
-    raw_data = await get_data(request.hashtags)
+    client = get_async_client(client_model)
+    started = time.perf_counter()
 
-    # Step 1: Create chunks
-    chunks_df = create_chunks_from_df(raw_data)
+    async def progress(name, **info):
+        if emit is not None:
+            await emit("stage", {"stage": name, "elapsed": round(time.perf_counter() - started, 3), **info})
+
+    # Hashtags kept up to date by the offline worker (utils/offline_task.py)
+    # already have their chunks embedded and upserted; steps 0-2 are skipped
+    with stage("load_precomputed"):
+        chunks_df = await asyncio.to_thread(load_precomputed, request.hashtags)
+    precomputed = chunks_df is not None
+
+    # Step 0 + 1: Stream data from postgres and create chunks
+    await progress("ingest", precomputed=precomputed)
+    if precomputed:
+        # Pick up vectors the worker wrote to a shared local index
+        await asyncio.to_thread(vector_store.refresh)
+    else:
+        chunks_df = await load_chunks(request.hashtags)
     #chunks_df = pd.read_csv("results.csv")
-    chunks_df['normalized_likes'] = (chunks_df['likes'] - chunks_df['likes'].min()) / (chunks_df['likes'].max() - chunks_df['likes'].min())
+    chunks_df['normalized_likes'] = log_normalized_likes(chunks_df['likes'])
 
-    # Step 2: Upsert embeddings to Pinecone
-    await upsert_embeddings_to_pinecone(chunks_df)
+    # Step 2: Upsert new or changed embeddings to Pinecone
+    dense = RETRIEVAL_MODE != "lexical"
+    if dense and not precomputed:
+        await progress("upsert", chunks=len(chunks_df))
+        try:
+            with stage("upsert_embeddings_to_pinecone"):
+                await upsert_embeddings_to_pinecone(chunks_df, scope=','.join(sorted(request.hashtags)), hashtags=request.hashtags)
+        except Exception as e:
+            if RETRIEVAL_MODE != "hybrid":
+                raise
+            print(f"Upsert failed, retrieving lexically: {e}")
+            dense = False
     
     # Step 3: Query Pinecone with input query
-    query_text = await query_rephrase(request.keyword, client_model, client)
+    await progress("rephrase")
+    with stage("query_rephrase"):
+        query_text = await query_rephrase(request.keyword, client_model, client, use_cache=request.use_cache)
     if not query_text:
         raise HTTPException(status_code=500, detail="Failed to rephrase query")
     
-    results = await query_pinecone(query_text, top_k=400)
+    await progress("retrieve", queries=len(query_text))
+    retrieval_filter = build_filter(request.hashtags, RETRIEVAL_LEVELS, RETRIEVAL_MIN_LIKE_BUCKET) if RETRIEVAL_SCOPED else None
+    dense_results = lexical_results = None
+    if dense:
+        try:
+            with stage("query_pinecone"):
+                dense_results = await query_pinecone(query_text, top_k=RETRIEVAL_TOP_K, filter=retrieval_filter)
+            record_items("query_pinecone", "matches", sum(len(res['matches']) for res in dense_results))
+        except Exception as e:
+            if RETRIEVAL_MODE != "hybrid":
+                raise
+            print(f"Dense retrieval failed, retrieving lexically: {e}")
+    if RETRIEVAL_MODE != "dense":
+        with stage("query_lexical"):
+            lexical_index = await asyncio.to_thread(get_lexical_index, chunks_df, request.hashtags)
+            lexical_results = await asyncio.to_thread(lexical_index.query_many, query_text, RETRIEVAL_TOP_K, retrieval_filter)
+        record_items("query_lexical", "matches", sum(len(res['matches']) for res in lexical_results))
+    results = dense_results if lexical_results is None else hybrid_results(dense_results, lexical_results)
     
     # Step 4: Rerank results and reconstruct full contexts
-    merged_df = pd.DataFrame()
-    for res in results:
-        results_df = rerank_results(res)
-        results_df = get_full_contexts(results_df, chunks_df)
-        merged_df = pd.concat([merged_df, results_df])
-    
-    merged_df = merged_df.drop_duplicates(subset=['chunk_id'], keep='first')
-    merged_df = merged_df.sort_values(by='combined_score', ascending=False)
-    merged_df.to_csv('merge.csv')
+    await progress("rerank")
+    with stage("rerank_results"):
+        parent_index, merged_df = await asyncio.to_thread(rerank, results, chunks_df)
+    record_items("rerank_results", "contexts", len(merged_df))
     
-    # Step 5: Generate scenarios
-    results = await generate_scenarios("./", merged_df['full_context'], request.keyword, client, client_model)
+    # Step 5: Generate scenarios from the token-budgeted context tree
+    prompt_template = PROMPT
+    shards = []
+    if GENERATION_MODE == "map_reduce":
+        shards = await asyncio.to_thread(shard_contexts, merged_df, parent_index, SHARD_TOKEN_BUDGET, MAX_SHARDS, client_model)
+    if len(shards) > 1:
+        # Map: per-shard findings in parallel; reduce: merge them into scenarios
+        await progress("map", contexts=len(merged_df), shards=len(shards), context_tokens=sum(t for _, t in shards))
+        with stage("extract_shard_findings"):
+            findings = await extract_shard_findings([text for text, _ in shards], request.keyword, None, SHARD_MODEL, use_cache=request.use_cache)
+        if not findings:
+            raise HTTPException(status_code=500, detail="Failed to extract findings from context shards")
+        reviews = '\n\n'.join(f"## Shard {i + 1}\n{text}" for i, text in enumerate(findings))
+        prompt_template = REDUCE_PROMPT
+        await progress("reduce", shards=len(findings))
+    else:
+        reviews, context_tokens = await asyncio.to_thread(pack_contexts, merged_df, parent_index, CONTEXT_TOKEN_BUDGET, client_model)
+        await progress("generate", contexts=len(merged_df), context_tokens=context_tokens)
+    generation_started = time.perf_counter()
+    if emit is None:
+        results = await generate_scenarios("./", reviews, request.keyword, client, client_model, prompt_template=prompt_template, use_cache=request.use_cache)
+    else:
+        # Emit each scenario object as soon as its JSON is complete
+        parser = JSONArrayStreamParser()
+        pieces = []
+        try:
+            async for delta in stream_scenarios(reviews, request.keyword, client, client_model, prompt_template=prompt_template, use_cache=request.use_cache):
+                pieces.append(delta)
+                for obj in parser.feed(delta):
+                    try:
+                        await emit("scenario", Scenario(**obj).model_dump())
+                    except ValidationError as e:
+                        print(f"Skipping malformed scenario: {e}")
+            results = ''.join(pieces)
+        except Exception as e:
+            print(f"Failed to generate: {e}")
+            results = None
+    record_stage("generate_scenarios", time.perf_counter() - generation_started)
     if results is None:
         raise HTTPException(status_code=500, detail="Failed to generate scenarios")
     
@@ -152,6 +400,135 @@ async def generate(request: GenerateRequest):
 
     return GenerateResponse(scenarios=scenarios)
 
+def result_settings():
+    # Everything besides the request and the data that changes a result, so
+    # a retuned deployment doesn't keep serving answers from the old settings
+    return [
+        GENERATION_MODE, SHARD_TOKEN_BUDGET, MAX_SHARDS, SHARD_MODEL, CONTEXT_TOKEN_BUDGET,
+        RETRIEVAL_MODE, RETRIEVAL_TOP_K, RETRIEVAL_SCOPED, RETRIEVAL_LEVELS, RETRIEVAL_MIN_LIKE_BUCKET,
+        RERANK_TOP_N,
+    ]
+
+def result_cache_key(request: GenerateRequest, snapshot: str) -> str:
+    keyword = ' '.join(request.keyword.lower().split())
+    hashtags = sorted({h.strip() for h in request.hashtags or [] if h.strip()})
+    payload = json.dumps([keyword, hashtags, snapshot, result_settings()])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+async def cached_result(request: GenerateRequest):
+    # Returns (cache key, cached GenerateResponse or None). The key includes
+    # the data snapshot of the hashtags, so new posts invalidate old results;
+    # it is None when the snapshot is unknown and the result can't be cached.
+    if result_cache is None or not request.use_cache:
+        return None, None
+    snapshot = await get_snapshot_version(request.hashtags)
+    if snapshot is None:
+        return None, None
+    key = result_cache_key(request, snapshot)
+    cached = await asyncio.to_thread(result_cache.get, key)
+    return key, GenerateResponse.model_validate_json(cached) if cached is not None else None
+
+@app.post("/generate", response_model=GenerateResponse)
+async def generate(request: GenerateRequest):
+    print(request)
+    key, response = await cached_result(request)
+    if response is not None:
+        return response
+    if not request.use_cache:
+        return await run_pipeline(request)
+
+    # Identical concurrent requests share one pipeline run
+    flight_key = key or result_cache_key(request, None)
+    response = await generate_flight.do(flight_key, lambda: run_pipeline(request))
+    if key is not None:
+        await asyncio.to_thread(result_cache.set, key, response.model_dump_json().encode('utf-8'))
+    return response
+
+@app.post("/generate/stream")
+async def generate_stream(request: GenerateRequest):
+    # Server-sent events: "stage" events while the pipeline runs, one
+    # "scenario" event per parsed Scenario, then "result" carrying the
+    # GenerateResponse payload (or "error" with the failure detail).
+    print(request)
+    queue = asyncio.Queue()
+
+    async def emit(event, data):
+        await queue.put((event, data))
+
+    async def produce():
+        try:
+            key, response = await cached_result(request)
+            if response is None:
+                response = await run_pipeline(request, emit)
+                if key is not None:
+                    await asyncio.to_thread(result_cache.set, key, response.model_dump_json().encode('utf-8'))
+            else:
+                await emit("stage", {"stage": "cached", "elapsed": 0.0})
+            await emit("result", response.model_dump())
+        except HTTPException as e:
+            await emit("error", {"status_code": e.status_code, "detail": e.detail})
+        except Exception as e:
+            print(f"Failed to generate: {e}")
+            await emit("error", {"status_code": 500, "detail": str(e)})
+
+    async def events():
+        task = asyncio.create_task(produce())
+        try:
+            while True:
+                event, data = await queue.get()
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+                if event in ("result", "error"):
+                    break
+        finally:
+            task.cancel()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/stats/db")
+async def db_stats():
+    return get_pool_stats()
+
+def cache_and_pool_gauges():
+    caches = {
+        "llm": get_llm_cache_stats(),
+        "embeddings": embedding_cache.stats() if embedding_cache is not None else {},
+        "results": result_cache.stats() if result_cache is not None else {},
+        "comments": get_comment_cache_stats(),
+    }
+    pool = get_pool_stats()
+    return [
+        ("scenario_cache_hits", "Cache hits since start.", {(("cache", name),): stats["hits"] for name, stats in caches.items() if stats}),
+        ("scenario_cache_misses", "Cache misses since start.", {(("cache", name),): stats["misses"] for name, stats in caches.items() if stats}),
+        ("scenario_cache_entries", "Entries currently stored per cache.", {(("cache", name),): stats["entries"] for name, stats in caches.items() if stats}),
+        ("scenario_db_pool_connections", "Postgres pool connections.", {
+            (("state", "total"),): pool.get("pool_size", 0),
+            (("state", "idle"),): pool.get("pool_idle", 0),
+        }),
+        ("scenario_db_wait_seconds_total", "Time spent waiting for a pooled connection.", {(): pool["wait_seconds_total"]}),
+        ("scenario_db_query_seconds_total", "Time spent running database queries.", {(): pool["query_seconds_total"]}),
+        ("scenario_generate_inflight", "Distinct /generate computations in flight.", {(): len(generate_flight)}),
+    ]
+
+collectors.append(cache_and_pool_gauges)
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/stats/cache")
+async def cache_stats():
+    return {
+        "llm": get_llm_cache_stats(),
+        "embeddings": embedding_cache.stats() if embedding_cache is not None else {},
+        "results": result_cache.stats() if result_cache is not None else {},
+        "comments": get_comment_cache_stats(),
+        "inflight": len(generate_flight),
+    }
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000, debug = True)
\ No newline at end of file
@@ -0,0 +1,11 @@
+import os
+
+# Benchmarks run offline: rag.chunk and utils.chat build their clients and
+# caches at import time, so point them at local backends before anything
+# from the app is imported. Explicit environment settings still win.
+os.environ.setdefault('VECTOR_STORE', 'local')
+os.environ.setdefault('EMBEDDING_CACHE_PATH', '')
+os.environ.setdefault('LLM_CACHE_PATH', '')
+os.environ.setdefault('RESULT_CACHE_PATH', '')
+os.environ.setdefault('COMMENT_CACHE_PATH', '')
+os.environ.setdefault('OPENAI_API_KEY', 'offline')
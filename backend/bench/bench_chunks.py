@@ -0,0 +1,138 @@
+# Benchmark for create_chunks_from_df against the previous iterrows-based
+# builder. Run from backend/:  python -m bench.bench_chunks --rows 10000 100000
+import time, argparse
+import numpy as np, pandas as pd
+
+from rag.chunk import ChunkBuilder, create_chunks_from_df
+
+
+def make_raw_data(n_rows, seed=0):
+    # Rows in the shape get_data returns: one row per (post, comment, reply),
+    # with reply columns empty for comments without replies.
+    rng = np.random.default_rng(seed)
+    n_posts = max(1, n_rows // 40)
+    post_ids = rng.integers(10**18, 10**19, n_posts, dtype=np.uint64)
+    post_of_row = np.sort(rng.integers(0, n_posts, n_rows))
+    comment_of_row = post_of_row * 1000 + rng.integers(0, 20, n_rows)
+    has_reply = rng.random(n_rows) < 0.4
+    return pd.DataFrame({
+        'post_id': post_ids[post_of_row],
+        'post_description': [f'post {p} #tag' for p in post_of_row],
+        'post_likes': rng.zipf(1.5, n_posts)[post_of_row],
+        'comment_id': comment_of_row + 7 * 10**15,
+        'comments': [f'comment {c}' for c in comment_of_row],
+        'comment_likes': rng.zipf(1.8, n_rows),
+        'replies': np.where(has_reply, [f'reply {i % 997}' for i in range(n_rows)], None),
+        'reply_likes': np.where(has_reply, rng.zipf(2.0, n_rows), np.nan),
+    })
+
+
+def legacy_create_chunks_from_df(df):
+    df['post_id'] = df['post_id'].astype(str)
+    df['comment_id'] = df['comment_id'].astype(str)
+    chunks = []
+    posts_df = df[['post_id', 'post_description', 'post_likes']].drop_duplicates('post_id')
+    for _, row in posts_df.iterrows():
+        chunks.append({'chunk_id': row['post_id'], 'parent_id': None, 'level': 'post',
+                       'text': row['post_description'], 'likes': row['post_likes'],
+                       'indices': {'post_id': row['post_id']}})
+    comments_df = df[['post_id', 'comment_id', 'comments', 'comment_likes']].drop_duplicates('comment_id')
+    for _, row in comments_df.iterrows():
+        chunks.append({'chunk_id': f"{row['post_id']}_{row['comment_id']}", 'parent_id': row['post_id'],
+                       'level': 'comment', 'text': str(row['comments']), 'likes': row['comment_likes'],
+                       'indices': {'post_id': row['post_id'], 'comment_id': row['comment_id']}})
+    replies_df = df[['post_id', 'comment_id', 'replies', 'reply_likes']].dropna(subset=['replies'])
+    replies_df = replies_df.drop_duplicates(['comment_id', 'replies'])
+    for idx, row in replies_df.iterrows():
+        reply_id = f"reply_{idx}"
+        chunks.append({'chunk_id': f"{row['post_id']}_{row['comment_id']}_{reply_id}",
+                       'parent_id': f"{row['post_id']}_{row['comment_id']}", 'level': 'reply',
+                       'text': str(row['replies']), 'likes': row['reply_likes'],
+                       'indices': {'post_id': row['post_id'], 'comment_id': row['comment_id'], 'reply_id': reply_id}})
+    chunks_df = pd.DataFrame(chunks)
+    return chunks_df[chunks_df['text'].notna() & (chunks_df['text'] != '')]
+
+
+def same_output(old, new):
+    # Reply ids differ by design (position vs content hash); everything else
+    # must match row for row.
+    if list(old.columns) != list(new.columns) or len(old) != len(new):
+        return False
+    cols = ['parent_id', 'level', 'text', 'likes']
+    replies = old['level'] == 'reply'
+    return (
+        old[cols].reset_index(drop=True).equals(new[cols].reset_index(drop=True))
+        and old.loc[~replies, 'chunk_id'].tolist() == new.loc[~replies.to_numpy(), 'chunk_id'].tolist()
+    )
+
+
+def edge_cases():
+    # Frames that once crashed the builders: no reply rows at all, as in a
+    # one-row frame or a cursor batch of comment-less posts
+    no_replies = pd.DataFrame({
+        'post_id': [1, 2], 'post_description': ['a post', 'another post'], 'post_likes': [3, 4],
+        # Object ids with NULLs, as utils.db.records_to_frame builds them
+        'comment_id': pd.Series([10, None], dtype=object), 'comments': ['a comment', None], 'comment_likes': [1, None],
+        'replies': [None, None], 'reply_likes': [None, None],
+    })
+    failures = []
+    chunks = create_chunks_from_df(no_replies.copy())
+    if sorted(chunks['chunk_id']) != ['1', '1_10', '2']:
+        failures.append(f"no replies: got {sorted(chunks['chunk_id'])}")
+    builder = ChunkBuilder()
+    builder.add(no_replies.iloc[:1].copy())
+    builder.add(no_replies.iloc[1:].copy())
+    if sorted(builder.result()['chunk_id']) != sorted(chunks['chunk_id']):
+        failures.append(f"no replies, streamed: got {sorted(builder.result()['chunk_id'])}")
+
+    # A post collected under two hashtags, each hashtag's rows in its own
+    # cursor batch: the streamed chunks must carry both, like the one-shot ones
+    two_hashtags = pd.DataFrame({
+        'post_id': [1, 1], 'post_description': ['a post', 'a post'], 'post_likes': [3, 3],
+        'hashtag': ['a', 'b'],
+        'comment_id': pd.Series([10, 10], dtype=object), 'comments': ['a comment', 'a comment'], 'comment_likes': [1, 1],
+        'replies': ['a reply', 'a reply'], 'reply_likes': [2, 2],
+    })
+    chunks = create_chunks_from_df(two_hashtags.copy())
+    builder = ChunkBuilder()
+    builder.add(two_hashtags.iloc[:1].copy())
+    builder.add(two_hashtags.iloc[1:].copy())
+    expected = [['a', 'b']] * len(chunks)
+    for name, result in (('one-shot', chunks), ('streamed', builder.result())):
+        if result['hashtags'].tolist() != expected:
+            failures.append(f"two hashtags, {name}: got {result['hashtags'].tolist()}")
+    return failures
+
+
+def timed(fn, df, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        data = df.copy()
+        start = time.perf_counter()
+        out = fn(data)
+        best = min(best, time.perf_counter() - start)
+    return best, out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    failures = edge_cases()
+    for failure in failures:
+        print(f"edge case failed: {failure}")
+    if failures:
+        raise SystemExit(1)
+
+    print(f"{'rows':>10} {'chunks':>10} {'iterrows s':>12} {'columnar s':>12} {'speedup':>8} identical")
+    for n_rows in args.rows:
+        df = make_raw_data(n_rows)
+        old_s, old = timed(legacy_create_chunks_from_df, df, 1)
+        new_s, new = timed(create_chunks_from_df, df, args.repeat)
+        print(f"{n_rows:>10} {len(new):>10} {old_s:>12.3f} {new_s:>12.3f} {old_s / new_s:>7.1f}x {same_output(old, new)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+# Comments-per-second benchmark for the comment quality filter: the previous
+# one-parse-per-comment path against the prefiltered nlp.pipe path, and
+# preprocess_tiktok_data with a fresh versus a persistent worker pool.
+# Needs spaCy and its model (SPACY_MODEL, en_core_web_sm by default).
+# Run from backend/:  python -m bench.bench_comments --comments 10000 100000
+import io, os, time, argparse, contextlib, tempfile
+import numpy as np
+import spacy
+
+from bench.synthetic import sentences, make_corpus, to_nested
+from utils import utils
+from utils.utils import classify_comments, preprocess_tiktok_data, prefilter_comment, is_meaningful_doc
+
+
+def legacy_classify(comments, nlp):
+    # The old is_meaningful_comment: rejects, then one full parse per comment
+    results = []
+    for comment in comments:
+        text = prefilter_comment(comment)
+        results.append(text is not None and is_meaningful_doc(nlp(text)))
+    return results
+
+
+def make_comments(n, seed=0, repeat_rate=0.15):
+    return sentences(np.random.default_rng(seed), n, 1, 18, repeat_rate=repeat_rate)
+
+
+def timed(fn, *args):
+    # preprocess_tiktok_data prints a warning per orphaned reply; keep that
+    # out of the output and the timing
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        out = fn(*args)
+        return time.perf_counter() - start, out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--comments', type=int, nargs='+', default=[2000, 20000])
+    parser.add_argument('--workers', type=int, default=None, help="preprocess_tiktok_data processes")
+    parser.add_argument('--skip-legacy', action='store_true', help="skip the slow one-parse-per-comment path")
+    args = parser.parse_args()
+
+    legacy_nlp = spacy.load(utils.NLP_MODEL, disable=["ner", "textcat"])
+    utils.get_nlp()
+    # A throwaway comment cache for this run
+    utils.COMMENT_CACHE_PATH = os.path.join(tempfile.mkdtemp(), 'comments.sqlite')
+
+    print(f"{'texts':>9} {'path':<28} {'seconds':>9} {'comments/s':>11} kept")
+    for n in args.comments:
+        comments = make_comments(n)
+        rows = []
+        if not args.skip_legacy:
+            rows.append(('per-comment nlp()', n, *timed(legacy_classify, comments, legacy_nlp)))
+        rows.append(('prefilter + nlp.pipe', n, *timed(classify_comments, comments, False)))
+        if not args.skip_legacy and rows[0][3] != rows[1][3]:
+            print("warning: per-comment and batched results differ")
+        # Memoized: a cold cache still dedupes repeats within the call, a
+        # warm one answers everything without parsing
+        utils.get_comment_cache().clear()
+        rows.append(('memoized, cold cache', n, *timed(classify_comments, comments)))
+        rows.append(('memoized, warm cache', n, *timed(classify_comments, comments)))
+
+        # End to end over a nested corpus of about n texts (posts, comments
+        # and replies), first with a new pool and empty cache, then warm
+        data = to_nested(make_corpus(n))
+        texts = sum(1 + len(post['comments']) + sum(len(c['replies']) for c in post['comments'].values()) for post in data.values())
+        utils.shutdown_executors()
+        utils.get_comment_cache().clear()
+        rows.append(('preprocess, cold pool+cache', texts, *timed(preprocess_tiktok_data, data, 1000, args.workers)))
+        rows.append(('preprocess, warm pool+cache', texts, *timed(preprocess_tiktok_data, data, 1000, args.workers)))
+
+        for name, count, seconds, out in rows:
+            kept = sum(out) if isinstance(out, list) else sum(1 + len(post['comments']) for post in out.values())
+            print(f"{count:>9} {name:<28} {seconds:>9.3f} {count / seconds:>11.0f} {kept}")
+    stats = utils.get_comment_cache_stats()
+    print(f"comment cache: {stats['hits']} hits, {stats['misses']} misses, hit rate {stats['hit_rate']:.1%}")
+    utils.shutdown_executors()
+
+
+if __name__ == '__main__':
+    main()
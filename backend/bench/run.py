@@ -0,0 +1,231 @@
+# Offline end-to-end benchmark: runs every pipeline stage on a synthetic
+# corpus against local stand-ins for OpenAI, Pinecone and Postgres, and
+# reports throughput and peak memory per stage for each corpus size.
+# Run from backend/:  python -m bench.run --rows 1000 10000 100000 1000000
+import argparse, asyncio, inspect, json, time, tracemalloc
+
+from bench.synthetic import HASHTAGS, make_corpus, to_nested
+from bench.standins import FakeEmbeddingsClient, FakeLLMClient, FakePool
+from rag import chunk
+from rag.chunk import (
+    ChunkBuilder, ParentIndex, build_filter, create_chunks_from_df, get_embeddings_async, log_normalized_likes,
+    query_pinecone, rerank_union, upsert_embeddings_to_pinecone
+)
+from rag.dedup import collapse_near_duplicates
+from rag.embed import AsyncEmbedder
+from rag.lexical import LexicalIndex, hybrid_results
+from rag.pack import pack_contexts
+from rag.store import LocalStore
+from utils import db
+from utils.chat import get_response_from_llm_async
+from utils.prompts import PROMPT, SUMMARY_GUIDE
+
+# utils.utils needs spaCy, langdetect and the translator; without them the
+# filter_languages and preprocess_tiktok_data stages are skipped
+try:
+    from utils.utils import filter_languages, preprocess_tiktok_data
+except ImportError as e:
+    print(f"Skipping filter_languages and preprocess_tiktok_data: {e}")
+    filter_languages = preprocess_tiktok_data = None
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+LLM_MODEL = "gpt-4o-2024-05-13"
+QUERIES = ["bag for work", "gym bag", "travel tote", "school backpack", "gift for mom"]
+
+
+class Bench:
+    # One pipeline run over a corpus. Each stage method reads what earlier
+    # stages left on self and returns the number of items it handled.
+    def __init__(self, df, args):
+        self.df = df
+        self.args = args
+        self.llm = FakeLLMClient(latency=args.llm_latency)
+        db.pool = FakePool(df)
+        # upsert_embeddings_to_pinecone and query_pinecone use the shared
+        # per-model embedder
+        chunk.embedders[EMBEDDING_MODEL] = AsyncEmbedder(
+            client=FakeEmbeddingsClient(args.dimension, args.embedding_latency), model=EMBEDDING_MODEL
+        )
+
+    async def get_data(self):
+        self.raw = await db.get_data(HASHTAGS, save_csv=False)
+        return len(self.raw)
+
+    async def stream_data(self):
+        builder = ChunkBuilder()
+        async for batch in db.stream_data(HASHTAGS, batch_size=self.args.batch_size):
+            builder.add(batch)
+        return len(builder.result())
+
+    def create_chunks_from_df(self):
+        self.chunks_df = create_chunks_from_df(self.raw.copy())
+        return len(self.chunks_df)
+
+    def filter_languages(self):
+        self.chunks_df = filter_languages(self.chunks_df, max_workers=self.args.workers)
+        return len(self.chunks_df)
+
+    def collapse_near_duplicates(self):
+        self.chunks_df = collapse_near_duplicates(self.chunks_df)
+        return len(self.chunks_df)
+
+    def preprocess_tiktok_data(self):
+        nested = to_nested(self.raw)
+        processed = preprocess_tiktok_data(nested, max_workers=self.args.workers)
+        return sum(1 + len(post['comments']) for post in processed.values())
+
+    async def get_embeddings(self):
+        texts = self.chunks_df['text'].astype(str).tolist()
+        await get_embeddings_async(texts, EMBEDDING_MODEL)
+        return len(texts)
+
+    async def upsert(self):
+        self.store = LocalStore(dimension=self.args.dimension, n_lists=self.args.n_lists)
+        counts = await upsert_embeddings_to_pinecone(self.chunks_df, store=self.store, model=EMBEDDING_MODEL)
+        return counts['upserted']
+
+    def retrieval_filter(self):
+        return build_filter(self.args.hashtags, self.args.levels, self.args.min_like_bucket)
+
+    async def query(self):
+        self.results = await query_pinecone(QUERIES, top_k=self.args.top_k, store=self.store, filter=self.retrieval_filter())
+        return sum(len(res['matches']) for res in self.results)
+
+    def lexical_index(self):
+        self.lexical = LexicalIndex(self.chunks_df)
+        return len(self.lexical)
+
+    def query_lexical(self):
+        lexical_results = self.lexical.query_many(QUERIES, top_k=self.args.top_k, filter=self.retrieval_filter())
+        dense_results = self.results if self.args.retrieval == 'hybrid' else None
+        self.results = hybrid_results(dense_results, lexical_results)
+        return sum(len(res['matches']) for res in lexical_results)
+
+    def rerank(self):
+        chunks_df = self.chunks_df
+        chunks_df['normalized_likes'] = log_normalized_likes(chunks_df['likes'])
+        self.parent_index = ParentIndex(chunks_df)
+        self.merged_df = rerank_union(self.results, chunks_df, self.parent_index, top_n=self.args.rerank_top_n)
+        return len(self.merged_df)
+
+    def pack_contexts(self):
+        self.reviews, tokens = pack_contexts(self.merged_df, self.parent_index, self.args.context_budget, LLM_MODEL)
+        return tokens
+
+    async def generate(self):
+        await get_response_from_llm_async(
+            SUMMARY_GUIDE.format(query=QUERIES[0]), client=self.llm, model=LLM_MODEL,
+            system_message="You are a helpful and smart assistant", use_cache=False
+        )
+        text, _ = await get_response_from_llm_async(
+            PROMPT.format(keyword=QUERIES[0], reviews=self.reviews), client=self.llm, model=LLM_MODEL,
+            system_message="You are a helpful and smart assistant", use_cache=False
+        )
+        return len(text)
+
+    def stages(self):
+        stages = [
+            ('get_data', 'rows', self.get_data),
+            ('stream_data+chunk', 'chunks', self.stream_data),
+            ('create_chunks_from_df', 'chunks', self.create_chunks_from_df),
+        ]
+        if preprocess_tiktok_data is not None:
+            stages.append(('filter_languages', 'chunks', self.filter_languages))
+            stages.append(('preprocess_tiktok_data', 'texts', self.preprocess_tiktok_data))
+        stages.append(('collapse_near_duplicates', 'chunks', self.collapse_near_duplicates))
+        if self.args.retrieval != 'lexical':
+            stages += [
+                ('get_embeddings', 'texts', self.get_embeddings),
+                ('upsert', 'vectors', self.upsert),
+                ('query_pinecone', 'matches', self.query),
+            ]
+        if self.args.retrieval != 'dense':
+            stages += [
+                ('lexical_index', 'chunks', self.lexical_index),
+                ('query_lexical', 'matches', self.query_lexical),
+            ]
+        return stages + [
+            ('rerank+contexts', 'contexts', self.rerank),
+            ('pack_contexts', 'tokens', self.pack_contexts),
+            ('generate', 'chars', self.generate),
+        ]
+
+
+async def run_stage(fn):
+    result = fn()
+    if inspect.isawaitable(result):
+        result = await result
+    return result
+
+
+async def run_once(df, args, trace_memory):
+    bench = Bench(df, args)
+    rows = []
+    for name, unit, fn in bench.stages():
+        if trace_memory:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        items = await run_stage(fn)
+        seconds = time.perf_counter() - start
+        row = {'stage': name, 'unit': unit, 'items': items, 'seconds': seconds}
+        if trace_memory:
+            row['peak_mb'] = (tracemalloc.get_traced_memory()[1] - before) / 2**20
+        rows.append(row)
+    return rows
+
+
+async def run(n_rows, args):
+    df = make_corpus(n_rows, seed=args.seed)
+    # Timings come from an untraced run; tracemalloc slows allocation-heavy
+    # stages down several times, so peak memory is measured in a second run.
+    rows = await run_once(df, args, trace_memory=False)
+    if args.memory:
+        tracemalloc.start()
+        try:
+            traced = await run_once(df, args, trace_memory=True)
+        finally:
+            tracemalloc.stop()
+        for row, traced_row in zip(rows, traced):
+            row['peak_mb'] = traced_row['peak_mb']
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--dimension', type=int, default=64, help="embedding size of the fake embedder")
+    parser.add_argument('--n-lists', type=int, default=0, help="IVF lists for the local store (0 = exact)")
+    parser.add_argument('--top-k', type=int, default=400)
+    parser.add_argument('--hashtags', nargs='+', help=f"scope retrieval to these of {HASHTAGS}")
+    parser.add_argument('--levels', nargs='+', help="scope retrieval to these chunk levels")
+    parser.add_argument('--min-like-bucket', type=int, default=0, help="scope retrieval to chunks with at least 10^n likes")
+    parser.add_argument('--retrieval', choices=['hybrid', 'dense', 'lexical'], default='hybrid',
+                        help="dense vectors, BM25 only, or both fused (default)")
+    parser.add_argument('--rerank-top-n', type=int, default=1000, help="chunks kept after reranking")
+    parser.add_argument('--batch-size', type=int, default=5000, help="rows per stream_data batch")
+    parser.add_argument('--context-budget', type=int, default=20000)
+    parser.add_argument('--workers', type=int, default=None, help="preprocess_tiktok_data processes")
+    parser.add_argument('--embedding-latency', type=float, default=0.0, help="seconds per fake embeddings request")
+    parser.add_argument('--llm-latency', type=float, default=0.0, help="seconds per fake completion")
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help="skip the tracemalloc run")
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'rows':>9} {'stage':<24} {'items':>9} {'seconds':>9} {'items/s':>11} {'peak MB':>8}")
+    for n_rows in args.rows:
+        for row in asyncio.run(run(n_rows, args)):
+            rate = row['items'] / row['seconds'] if row['seconds'] else float('inf')
+            peak = f"{row['peak_mb']:>8.1f}" if 'peak_mb' in row else f"{'-':>8}"
+            print(f"{n_rows:>9} {row['stage']:<24} {row['items']:>9} {row['seconds']:>9.3f} {rate:>11.0f} {peak}")
+            results.append({'rows': n_rows, **row, 'items_per_s': rate})
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+import asyncio, hashlib, json
+from types import SimpleNamespace
+import numpy as np
+
+# Local stand-ins for the external services the pipeline talks to, so every
+# stage can run offline. They mimic the slice of each client API the code
+# uses, return deterministic results, and cost no more than building the
+# response; the LocalStore in rag.store takes Pinecone's place.
+
+
+class FakeEmbeddings:
+    def __init__(self, dimension, latency):
+        self.dimension = dimension
+        self.latency = latency
+
+    def embed(self, text):
+        # Deterministic unit vector seeded by the text
+        seed = int.from_bytes(hashlib.sha1(text.encode('utf-8')).digest()[:8], 'little')
+        vector = np.random.default_rng(seed).standard_normal(self.dimension).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    async def create(self, input, model, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        texts = [input] if isinstance(input, str) else input
+        return SimpleNamespace(
+            data=[SimpleNamespace(embedding=self.embed(text), index=i) for i, text in enumerate(texts)],
+            usage=SimpleNamespace(total_tokens=sum(len(text) // 4 + 1 for text in texts)),
+        )
+
+
+class FakeEmbeddingsClient:
+    # AsyncOpenAI stand-in for AsyncEmbedder; latency is per request
+    def __init__(self, dimension=64, latency=0.0):
+        self.embeddings = FakeEmbeddings(dimension, latency)
+
+
+def fake_completion(messages, n_scenarios=5):
+    # Query rewrites for the rephrase prompt, a JSON scenario list otherwise
+    prompt = messages[-1]['content']
+    if '<query>' in prompt:
+        queries = [f'query {i}' for i in range(5)]
+        return f'<query>\n{queries}\n</query>'
+    scenarios = [
+        {
+            'scenario': f'scenario {i}',
+            'reason': 'synthetic',
+            'hashtags': ['#bench'],
+            'content_guidance': {'hook': 'synthetic'},
+        }
+        for i in range(n_scenarios)
+    ]
+    return '```json\n' + json.dumps(scenarios, indent=2) + '\n```'
+
+
+class FakeCompletions:
+    def __init__(self, latency):
+        self.latency = latency
+
+    async def create(self, model, messages, stream=False, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        content = fake_completion(messages)
+        usage = SimpleNamespace(
+            prompt_tokens=sum(len(m['content']) // 4 + 1 for m in messages),
+            completion_tokens=len(content) // 4 + 1,
+        )
+        if not stream:
+            return SimpleNamespace(
+                choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=usage
+            )
+
+        async def chunks():
+            for i in range(0, len(content), 64):
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content[i:i+64]))], usage=None)
+            yield SimpleNamespace(choices=[], usage=usage)
+        return chunks()
+
+
+class FakeLLMClient:
+    # AsyncOpenAI stand-in for utils.chat (chat.completions.create, with or
+    # without stream=True)
+    def __init__(self, latency=0.0):
+        self.chat = SimpleNamespace(completions=FakeCompletions(latency))
+
+
+class FakeCursor:
+    def __init__(self, records):
+        self.records = records
+        self.offset = 0
+
+    async def fetch(self, n):
+        batch = self.records[self.offset:self.offset + n]
+        self.offset += n
+        return batch
+
+
+class FakeTransaction:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeConnection:
+    def __init__(self, records):
+        self.records = records
+
+    async def fetch(self, query, *args):
+        return list(self.records)
+
+    async def cursor(self, query, *args):
+        return FakeCursor(self.records)
+
+    def transaction(self):
+        return FakeTransaction()
+
+
+class FakeAcquire:
+    def __init__(self, connection):
+        self.connection = connection
+
+    async def __aenter__(self):
+        return self.connection
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakePool:
+    # asyncpg pool stand-in for utils.db: every query returns the rows of df
+    # (as records, the way asyncpg does) whatever the query.
+    def __init__(self, df):
+        columns = list(df.columns)
+        records = [dict(zip(columns, row)) for row in df.itertuples(index=False, name=None)]
+        self.connection = FakeConnection(records)
+
+    def acquire(self):
+        return FakeAcquire(self.connection)
+
+    async def close(self):
+        pass
+
+    def get_size(self):
+        return 1
+
+    def get_idle_size(self):
+        return 1
+
+    def get_min_size(self):
+        return 1
+
+    def get_max_size(self):
+        return 1
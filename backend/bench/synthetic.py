@@ -0,0 +1,96 @@
+import numpy as np, pandas as pd
+
+# Synthetic TikTok corpus in the shape get_data returns: one row per
+# (post, comment, reply) from the posts/comments/replies join, with comment
+# and reply columns empty where a post has no comments or a comment has no
+# replies. Fan-out and likes are heavy-tailed like real engagement data.
+
+WORDS = (
+    "bag tote strap zipper pocket laptop gym travel work school canvas leather "
+    "cute where buy link price quality broke cheap love need color size fits "
+    "daily commute water bottle books heavy shoulder pain comfy style outfit "
+    "gift sister mom college office airport weekend beach market groceries"
+).split()
+# hashtag_keyword values; each post is collected under one of them
+HASHTAGS = ["bag", "tote", "backpack", "handbag"]
+REPEATS = ["where is it from", "link please", "I need this", "so cute", "love it", "❤️❤️❤️", "😍", "price?"]
+
+
+def sentences(rng, n, low=4, high=18, repeat_rate=0.0):
+    # n random texts; a repeat_rate share are copies of common short comments
+    lengths = rng.integers(low, high, n)
+    words = rng.choice(WORDS, (n, high))
+    texts = [' '.join(w[:k]) for w, k in zip(words, lengths)]
+    if repeat_rate:
+        repeats = np.flatnonzero(rng.random(n) < repeat_rate)
+        for i, choice in zip(repeats, rng.choice(REPEATS, len(repeats))):
+            texts[i] = choice
+    return texts
+
+
+def make_corpus(n_rows, seed=0, repeat_rate=0.15):
+    rng = np.random.default_rng(seed)
+
+    # Comments per post follow a Zipf law (5% of posts have none) and
+    # replies per comment a geometric one. Enough posts are drawn to cover
+    # n_rows join rows, then the result is cut to exactly n_rows.
+    n_posts = max(1, n_rows // 8)
+    while True:
+        n_comments = np.minimum(rng.zipf(1.7, n_posts), 500)
+        n_comments[rng.random(n_posts) < 0.05] = 0
+        n_replies = rng.geometric(0.6, n_comments.sum()) - 1
+        comment_post = np.repeat(np.arange(n_posts), n_comments)
+        rows_per_post = np.bincount(comment_post, weights=np.maximum(n_replies, 1), minlength=n_posts)
+        rows_per_post[n_comments == 0] = 1
+        if rows_per_post.sum() >= n_rows:
+            break
+        n_posts *= 2
+
+    post_ids = 7_300_000_000_000_000_000 + np.cumsum(rng.integers(1, 10**6, n_posts))
+    comment_ids = 7_400_000_000_000_000_000 + np.cumsum(rng.integers(1, 10**6, len(comment_post)))
+    reply_comment = np.repeat(np.arange(len(comment_post)), n_replies)
+
+    posts_df = pd.DataFrame({
+        'post_id': post_ids,
+        'post_description': [t + ' #' + w for t, w in zip(sentences(rng, n_posts), rng.choice(WORDS, n_posts))],
+        'post_likes': rng.zipf(1.6, n_posts) * 100,
+        'hashtag': rng.choice(HASHTAGS, n_posts),
+    })
+    comments_df = pd.DataFrame({
+        'post_id': post_ids[comment_post],
+        'comment_id': pd.array(comment_ids, dtype='Int64'),
+        'comments': sentences(rng, len(comment_post), repeat_rate=repeat_rate),
+        'comment_likes': pd.array(rng.zipf(1.8, len(comment_post)) + 4, dtype='Int64'),
+    })
+    replies_df = pd.DataFrame({
+        'comment_id': pd.array(comment_ids[reply_comment], dtype='Int64'),
+        'replies': sentences(rng, len(reply_comment), 2, 10, repeat_rate=repeat_rate),
+        'reply_likes': pd.array(rng.zipf(2.2, len(reply_comment)) - 1, dtype='Int64'),
+    })
+
+    df = posts_df.merge(comments_df, on='post_id', how='left')
+    df = df.merge(replies_df, on='comment_id', how='left')
+    df = df.head(n_rows).reset_index(drop=True)
+    # asyncpg hands back None for the NULLs of the LEFT JOINs
+    for col in ['comment_id', 'comments', 'comment_likes', 'replies', 'reply_likes']:
+        df[col] = df[col].astype(object).where(df[col].notna(), None)
+    return df[['post_id', 'post_description', 'post_likes', 'hashtag', 'comment_id', 'comments',
+               'comment_likes', 'replies', 'reply_likes']]
+
+
+def to_nested(df):
+    # The {post_id: {description, post_likes, comments: {...}}} structure
+    # preprocess_tiktok_data expects
+    data = {}
+    for row in df.itertuples(index=False):
+        post = data.setdefault(str(row.post_id), {
+            'description': row.post_description, 'post_likes': row.post_likes, 'comments': {}
+        })
+        if row.comment_id is None:
+            continue
+        comment = post['comments'].setdefault(str(row.comment_id), {
+            'text': row.comments, 'comment_likes': row.comment_likes, 'replies': []
+        })
+        if row.replies is not None:
+            comment['replies'].append({'text': row.replies, 'reply_likes': row.reply_likes})
+    return data
@@ -1,9 +1,9 @@
-from openai import OpenAI
-import numpy as np, os, pinecone, pandas as pd, time,asyncio
+import numpy as np, os, pinecone, pandas as pd, asyncio, json, hashlib
 from dotenv import load_dotenv
-from openai import OpenAI
-from pinecone import Pinecone, ServerlessSpec
-from concurrent.futures import ThreadPoolExecutor
+from rag.store import get_vector_store, query_executor
+from rag.embed_cache import get_embedding_cache
+from rag.embed import AsyncEmbedder
+from utils.metrics import stage, record_items
 from functools import partial
 import logging
 
@@ -12,237 +12,484 @@ logger = logging.getLogger(__name__)
 
 
 load_dotenv()
-client = OpenAI()
-# Initialize Pinecone
-pinecone_api_key = os.getenv('PINECONE_API_KEY')
-cloud = os.environ.get('PINECONE_CLOUD') or 'aws'
-region = os.environ.get('PINECONE_REGION') or 'us-east-1'
-spec = ServerlessSpec(cloud=cloud, region=region)
-index_name = 'tiktok-data'
-pc = Pinecone(api_key=pinecone_api_key )
-existing_indexes = [
-    index_info["name"] for index_info in pc.list_indexes()
-]
-
-# check if index already exists (it shouldn't if this is first time)
-if index_name not in existing_indexes:
-    # if does not exist, create index
-    pc.create_index(
-        index_name,
-        dimension=1536,  # dimensionality of minilm
-        metric='dotproduct',
-        spec=spec
+# Vector store backend (Pinecone by default, VECTOR_STORE=local for in-process)
+vector_store = get_vector_store()
+# Persistent (model, text hash) -> embedding cache, None when disabled
+embedding_cache = get_embedding_cache()
+# One async embedding engine per model, shared by upserts and queries
+embedders = {}
+
+def reply_ids(replies_df):
+    # Stable reply ids derived from (post, comment, reply text) rather than
+    # the DataFrame position, so the same reply keeps its chunk_id across
+    # requests. hash_pandas_object uses a fixed key, so ids are reproducible.
+    hashes = pd.util.hash_pandas_object(
+        replies_df[['post_id', 'comment_id', 'replies']].astype(str), index=False
     )
-    # wait for index to be initialized
-    while not pc.describe_index(index_name).status['ready']:
-        time.sleep(1)
-index = pc.Index(index_name)
+    # str.format rather than np.char: np.char.mod turns an empty uint64 array
+    # into float64, which np.char.add then rejects
+    return 'reply_' + hashes.map('{:016x}'.format).astype(object)
+
 
-def create_chunks_from_df(df):
+def chunk_parts(df, with_indices=True):
+    # Post, comment and reply chunk frames for df, before the empty-text filter
+    # Posts without comments come back from the LEFT JOIN with a NULL
+    # comment; they only contribute a post chunk
+    has_comment = df['comment_id'].notna()
     # Ensure IDs are strings
-    #logger.debug()
     df['post_id'] = df['post_id'].astype(str)
     df['comment_id'] = df['comment_id'].astype(str)
-    
-    chunks = []
-    
-    # Process posts
+
+    # Posts
     posts_df = df[['post_id', 'post_description', 'post_likes']].drop_duplicates('post_id')
-    for _, row in posts_df.iterrows():
-        chunks.append({
-            'chunk_id': row['post_id'],
-            'parent_id': None,
-            'level': 'post',
-            'text': row['post_description'],
-            'likes': row['post_likes'],
-            'indices': {
-                'post_id': row['post_id']
-            }
-        })
-    
-    # Process comments
-    comments_df = df[['post_id', 'comment_id', 'comments', 'comment_likes']].drop_duplicates('comment_id')
-    for _, row in comments_df.iterrows():
-        chunks.append({
-            'chunk_id': f"{row['post_id']}_{row['comment_id']}",
-            'parent_id': row['post_id'],
-            'level': 'comment',
-            'text': str(row['comments']),
-            'likes': row['comment_likes'],
-            'indices': {
-                'post_id': row['post_id'],
-                'comment_id': row['comment_id']
-            }
-        })
-    
-    # Process replies
+    posts = pd.DataFrame({
+        'chunk_id': posts_df['post_id'],
+        'parent_id': None,
+        'level': 'post',
+        'text': posts_df['post_description'],
+        'likes': posts_df['post_likes'],
+    })
+
+    # Comments
+    comments_df = df.loc[has_comment, ['post_id', 'comment_id', 'comments', 'comment_likes']].drop_duplicates('comment_id')
+    comments = pd.DataFrame({
+        'chunk_id': comments_df['post_id'] + '_' + comments_df['comment_id'],
+        'parent_id': comments_df['post_id'],
+        'level': 'comment',
+        'text': comments_df['comments'].astype(str),
+        'likes': comments_df['comment_likes'],
+    })
+
+    # Replies
     replies_df = df[['post_id', 'comment_id', 'replies', 'reply_likes']].dropna(subset=['replies'])
     replies_df = replies_df.drop_duplicates(['comment_id', 'replies'])
-    for idx, row in replies_df.iterrows():
-        reply_id = f"reply_{idx}"
-        chunks.append({
-            'chunk_id': f"{row['post_id']}_{row['comment_id']}_{reply_id}",
-            'parent_id': f"{row['post_id']}_{row['comment_id']}",
-            'level': 'reply',
-            'text': str(row['replies']),
-            'likes': row['reply_likes'],
-            'indices': {
-                'post_id': row['post_id'],
-                'comment_id': row['comment_id'],
-                'reply_id': reply_id
-            }
-        })
-    
-    chunks_df = pd.DataFrame(chunks)
+    reply_id = reply_ids(replies_df)
+    reply_parent = replies_df['post_id'] + '_' + replies_df['comment_id']
+    replies = pd.DataFrame({
+        'chunk_id': reply_parent + '_' + reply_id,
+        'parent_id': reply_parent,
+        'level': 'reply',
+        'text': replies_df['replies'].astype(str),
+        'likes': replies_df['reply_likes'],
+    })
+
+    if 'hashtag' in df:
+        # Hashtags each post was collected under, inherited by its comments
+        # and replies; stored as vector metadata for filtered retrieval
+        post_hashtags = df.dropna(subset=['hashtag']).groupby('post_id', sort=False)['hashtag'].agg(
+            lambda tags: sorted(set(tags))
+        )
+        posts['hashtags'] = posts_df['post_id'].map(post_hashtags)
+        comments['hashtags'] = comments_df['post_id'].map(post_hashtags)
+        replies['hashtags'] = replies_df['post_id'].map(post_hashtags)
+
+    parts = [posts, comments, replies]
+    if with_indices:
+        # Nested id dict per chunk, kept for consumers that read 'indices'
+        posts['indices'] = [{'post_id': p} for p in posts_df['post_id']]
+        comments['indices'] = [
+            {'post_id': p, 'comment_id': c}
+            for p, c in zip(comments_df['post_id'], comments_df['comment_id'])
+        ]
+        replies['indices'] = [
+            {'post_id': p, 'comment_id': c, 'reply_id': r}
+            for p, c, r in zip(replies_df['post_id'], replies_df['comment_id'], reply_id)
+        ]
+    return parts
+
 
-    chunks_df = chunks_df[chunks_df['text'].notna() & (chunks_df['text'] != '')]
-    #chunks_df.to_csv("results.csv")
+def drop_empty_chunks(chunks_df):
+    return chunks_df[chunks_df['text'].notna() & (chunks_df['text'] != '')]
+
+
+def create_chunks_from_df(df, with_indices=True):
+    parts = chunk_parts(df, with_indices)
+    chunks_df = pd.concat([part for part in parts if len(part)] or parts, ignore_index=True)
+
+    chunks_df = drop_empty_chunks(chunks_df)
     
     return chunks_df
 
 
+class ChunkBuilder:
+    # Incremental create_chunks_from_df for record batches streamed from the
+    # database. Each batch only keeps chunks not seen in earlier batches;
+    # add() returns them so callers can process chunks as they arrive, and
+    # result() gives the same rows in the same order as the one-shot builder.
+    # A post collected under several hashtags can come back in a later batch
+    # under another one; those hashtags are merged into result().
+    def __init__(self, with_indices=True):
+        self.with_indices = with_indices
+        self.seen = set()
+        self.parts = {'post': [], 'comment': [], 'reply': []}
+        # chunk_id -> hashtags found in batches after the chunk's first
+        self.more_hashtags = {}
 
+    def add(self, df):
+        new_parts = []
+        for level, part in zip(['post', 'comment', 'reply'], chunk_parts(df, self.with_indices)):
+            # Set lookups per id: isin() would turn the whole seen set into an
+            # array on every batch
+            ids = part['chunk_id'].tolist()
+            seen = np.fromiter((chunk_id in self.seen for chunk_id in ids), dtype=bool, count=len(ids))
+            if 'hashtags' in part and seen.any():
+                for chunk_id, hashtags in zip(part.loc[seen, 'chunk_id'], part.loc[seen, 'hashtags']):
+                    if isinstance(hashtags, list):
+                        self.more_hashtags.setdefault(chunk_id, set()).update(hashtags)
+            part = part[~seen]
+            if not len(part):
+                continue
+            self.seen.update(part['chunk_id'].tolist())
+            self.parts[level].append(part)
+            new_parts.append(part)
+        if not new_parts:
+            return pd.DataFrame()
+        return drop_empty_chunks(pd.concat(new_parts, ignore_index=True))
 
-def get_embeddings(texts, model = "text-embedding-3-small",  batch_size = 100):
-    embeddings = []
-    for i in range(0, len(texts), batch_size):
-        batch_texts = texts[i:i+batch_size]
-        max_retries = 5
-        for retry in range(max_retries):
-            try:
-                response = client.embeddings.create(input=batch_texts, model=model)
-                #breakpoint()
-                batch_embeddings = [data.embedding for data in response.data]
-                embeddings.extend(batch_embeddings)
-                break
-            except Exception as e:
-                if retry < max_retries - 1:
-                    time.sleep(2 ** retry)
-                else:
-                    print(f"Error generating embeddings for batch starting at index {i}: {e}")
-                    raise e
+    def result(self):
+        parts = self.parts['post'] + self.parts['comment'] + self.parts['reply']
+        if not parts:
+            return pd.DataFrame(columns=['chunk_id', 'parent_id', 'level', 'text', 'likes'])
+        chunks_df = drop_empty_chunks(pd.concat(parts, ignore_index=True))
+        if self.more_hashtags and 'hashtags' in chunks_df:
+            chunks_df['hashtags'] = [
+                sorted(set(hashtags) | self.more_hashtags[chunk_id]) if chunk_id in self.more_hashtags else hashtags
+                for chunk_id, hashtags in zip(chunks_df['chunk_id'], chunks_df['hashtags'])
+            ]
+        return chunks_df
+
+
+def get_embedder(model = "text-embedding-3-small"):
+    if model not in embedders:
+        embedders[model] = AsyncEmbedder(
+            model=model,
+            max_batch_tokens=int(os.getenv('EMBEDDING_BATCH_TOKENS', '100000')),
+            max_concurrency=int(os.getenv('EMBEDDING_CONCURRENCY', '4')),
+        )
+    return embedders[model]
+
+
+async def get_embeddings_async(texts, model = "text-embedding-3-small", cache = None, embedder = None):
+    # One embedding per text, served from the persistent cache where
+    # possible. Never blocks the event loop: cache reads and writes run in a
+    # worker thread and misses go through the async embedding engine.
+    with stage('get_embeddings'):
+        return await embed_with_cache(list(texts), model, cache, embedder)
+
+
+async def embed_with_cache(texts, model, cache, embedder):
+    if cache is None:
+        cache = embedding_cache
+    if embedder is None:
+        embedder = get_embedder(model)
+    record_items('get_embeddings', 'texts', len(texts))
+    if cache is None:
+        return await embedder.embed(texts)
+
+    embeddings = await asyncio.to_thread(cache.get_many, texts, model)
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    if missing:
+        missing_texts = list(dict.fromkeys(texts[i] for i in missing))
+        new_embeddings = await embedder.embed(missing_texts)
+        await asyncio.to_thread(cache.set_many, missing_texts, new_embeddings, model)
+        by_text = dict(zip(missing_texts, new_embeddings))
+        for i in missing:
+            embeddings[i] = by_text[texts[i]]
+    record_items('get_embeddings', 'cache_misses', len(missing))
+    logger.info(f"Embedding cache: {len(texts) - len(missing)} hits, {len(missing)} misses")
     return embeddings
 
 
-async def upsert_embeddings_to_pinecone(chunks_df,batch_size = 300):
-    # Generate embeddings
-    texts = [str(text) for text in chunks_df['text'].tolist() if str(text).strip()]
-    embeddings = get_embeddings(texts)
-    chunks_df['embedding'] = embeddings
+def chunk_hash(record, model):
+    # Everything that ends up in the stored vector or its metadata
+    fields = [model, record['text'], record['parent_id'], record['level'], float(record['likes'])]
+    if isinstance(record.get('hashtags'), list):
+        fields.append(sorted(record['hashtags']))
+    if record.get('duplicates', 1) > 1:
+        fields.append(int(record['duplicates']))
+    payload = json.dumps(fields, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def like_bucket(likes):
+    # Order of magnitude of the like count: 0 for 0-8 likes, 1 for 9-98, ...
+    return int(np.floor(np.log10(max(float(likes), 0.0) + 1)))
+
+
+def chunk_metadata(record):
+    metadata = {
+        'chunk_id': record['chunk_id'],
+        'parent_id': record['parent_id'],
+        'level': record['level'],
+        'likes': record['likes'],
+        'like_bucket': like_bucket(record['likes']),
+        'text': record['text']
+    }
+    if isinstance(record.get('hashtags'), list):
+        metadata['hashtags'] = list(record['hashtags'])
+    if record.get('duplicates', 1) > 1:
+        metadata['duplicates'] = int(record['duplicates'])
+    return metadata
+
+
+def build_filter(hashtags=None, levels=None, min_like_bucket=None):
+    # Metadata filter (Pinecone syntax, also understood by LocalStore) that
+    # scopes a query to chunks tagged at upsert time; None when unscoped
+    conditions = {}
+    if hashtags:
+        conditions['hashtags'] = {'$in': sorted(hashtags)}
+    if levels:
+        conditions['level'] = {'$in': sorted(levels)}
+    if min_like_bucket:
+        conditions['like_bucket'] = {'$gte': min_like_bucket}
+    return conditions or None
+
+
+async def upsert_embeddings_to_pinecone(chunks_df,batch_size = 300, store = None, scope = None, prune = False, model = "text-embedding-3-small", hashtags = None):
+    # Only chunks that are new or changed since the last upsert (according to
+    # the store's manifest) are embedded and written. With a scope (e.g. the
+    # request's hashtag set) and prune=True, chunks previously written under
+    # that scope that are no longer present are deleted as well. Chunks are
+    # tagged with their hashtags column, or with hashtags when there is none,
+    # plus the hashtags already recorded for them in the manifest: a chunk
+    # shared by two hashtags stays tagged with both whichever one is upserted.
+    # Hashing and manifest lookups run in worker threads, never on the loop.
+    if store is None:
+        store = vector_store
+    manifest = store.manifest
+
+    hashes, records = await asyncio.to_thread(changed_records, chunks_df, manifest, model, hashtags)
+    if records:
+        # Generate embeddings for the changed chunks only
+        embeddings = await get_embeddings_async([str(record['text']) for record in records], model=model)
+        vectors = await asyncio.to_thread(to_vectors, records, embeddings)
+
+        # Upsert to the vector store in batches
+        await asyncio.to_thread(store.upsert, vectors, batch_size=batch_size)
 
-    # Prepare data for upsert
-    vectors = []
+    deleted = []
+    if manifest is not None:
+        deleted = await asyncio.to_thread(record_upsert, manifest, hashes, records, scope, prune)
+        if deleted:
+            await asyncio.to_thread(store.delete, deleted)
+
+    logger.info(f"Upsert: {len(records)} written, {len(hashes) - len(records)} unchanged, {len(deleted)} deleted")
+    return {'upserted': len(records), 'unchanged': len(hashes) - len(records), 'deleted': len(deleted)}
+
+
+def changed_records(chunks_df, manifest, model, hashtags=None):
+    # chunk_id -> content hash for every non-blank chunk, and the records of
+    # those the manifest doesn't have at that hash
     metadata_cols = ['chunk_id', 'parent_id', 'level', 'likes', 'text']
+    if 'hashtags' in chunks_df:
+        metadata_cols.append('hashtags')
+    if 'duplicates' in chunks_df:
+        metadata_cols.append('duplicates')
     chunks_df['parent_id'] = chunks_df['parent_id'].fillna('')
     chunks_df['likes'] = chunks_df['likes'].fillna(0)
     chunks_df['text'] = chunks_df['text'].fillna('')
 
-    # Convert DataFrame to list of records
-    records = chunks_df.to_dict('records')
+    # Convert DataFrame to list of records, skipping blank texts
+    records = [
+        record for record in chunks_df[metadata_cols].to_dict('records')
+        if str(record['text']).strip()
+    ]
+    if 'hashtags' not in chunks_df and hashtags:
+        for record in records:
+            record['hashtags'] = sorted(hashtags)
+    if manifest is not None:
+        # Union before hashing, so a chunk only seen under fewer hashtags
+        # than it was stored with counts as unchanged
+        tagged = [record for record in records if isinstance(record.get('hashtags'), list)]
+        stored = manifest.hashtags([record['chunk_id'] for record in tagged])
+        for record in tagged:
+            if record['chunk_id'] in stored:
+                record['hashtags'] = sorted(set(record['hashtags']) | set(stored[record['chunk_id']]))
+    hashes = {record['chunk_id']: chunk_hash(record, model) for record in records}
+    if manifest is not None:
+        changed = set(manifest.changed(hashes))
+        records = [record for record in records if record['chunk_id'] in changed]
+    return hashes, records
+
 
-    # Create the list of vectors
-    vectors = [
+def to_vectors(records, embeddings):
+    return [
         {
             "id": record['chunk_id'],
-            "values": record['embedding'],
-            "metadata": {
-                'chunk_id': record['chunk_id'],
-                'parent_id': record['parent_id'],
-                'level': record['level'],
-                'likes': record['likes'],
-                'text': record['text']
-            }
+            "values": embedding,
+            "metadata": chunk_metadata(record)
         }
-        for record in records
+        for record, embedding in zip(records, embeddings)
     ]
 
-    # Upsert to Pinecone in batches
-    
-    for i in range(0, len(vectors), batch_size):
-        batch = vectors[i:i+batch_size]
-        index.upsert(vectors=batch)
-
 
+def record_upsert(manifest, hashes, records, scope=None, prune=False):
+    # Records the written chunks in the manifest and tags every chunk with
+    # scope; with prune, returns the ids that left the scope and no other
+    # scope refers to, for the caller to delete from the store
+    if records:
+        manifest.record(
+            {record['chunk_id']: hashes[record['chunk_id']] for record in records},
+            {record['chunk_id']: record['hashtags'] for record in records if isinstance(record.get('hashtags'), list)},
+        )
+    if scope is None:
+        return []
+    manifest.tag(hashes, scope)
+    if not prune:
+        return []
+    return manifest.release(manifest.stale(hashes, scope), scope)
 
 
-
-async def query_pinecone_async(vector, top_k=10):
-    executor = ThreadPoolExecutor(max_workers=5)
-    loop = asyncio.get_event_loop()
-    func = partial(index.query, vector=vector, top_k=top_k, includeMetadata = True)
-    response = await loop.run_in_executor(executor, func)
+async def query_pinecone_async(vector, top_k=10, store=None, filter=None):
+    if store is None:
+        store = vector_store
+    loop = asyncio.get_running_loop()
+    func = partial(store.query, vector=vector, top_k=top_k, include_metadata = True, filter=filter)
+    response = await loop.run_in_executor(query_executor, func)
     return response
 
-async def query_pinecone(query_text, top_k=10):
+async def query_pinecone(query_text, top_k=10, store=None, filter=None):
+    # All query vectors go to the store as one batch. Matches that come back
+    # without metadata (LocalStore) have it fetched once for the deduplicated
+    # union of their ids, so every response keeps the
+    # {'matches': [{'id', 'score', 'metadata'}]} shape. filter (see
+    # build_filter) is applied by the store before ranking.
+    if store is None:
+        store = vector_store
     # Get embedding for the query text
-    query_embedding = get_embeddings(query_text)
-    # Query Pinecone
-    tasks = [query_pinecone_async(query,top_k) for query in query_embedding]
-    responses = await asyncio.gather(*tasks)
-    
-    return responses
-
-def rerank_results(results, likes_weight=0.5, similarity_weights=0.5):
-    # Convert results to DataFrame
-    data = []
-    for match in results['matches']:
-        metadata = match['metadata']
-        score = match['score']
-        data.append({
-            'chunk_id': metadata['chunk_id'],
-            'text': metadata['text'],
-            'level': metadata['level'],
-            'likes': metadata['likes'],
-            'score': score,
-            'parent_id': metadata['parent_id']
-        })
-    results_df = pd.DataFrame(data)
-    
-    # Rerank based on combined score (you can adjust weights as needed)
-    
-    results_df['normalized_likes'] = (results_df['likes'] - results_df['likes'].min()) / (results_df['likes'].max() - results_df['likes'].min())
-    results_df['combined_score'] = likes_weight * results_df['normalized_likes'] + results_df['score'] * similarity_weights
-    
-    return results_df
+    query_embedding = await get_embeddings_async(query_text)
+    # query_many fans out on query_executor itself, so it runs on the
+    # default executor to avoid waiting on its own pool
+    responses = await asyncio.to_thread(store.query_many, query_embedding, top_k, filter)
+    ids = list(dict.fromkeys(match['id'] for response in responses for match in response['matches']))
+    record_items('query_pinecone', 'unique_matches', len(ids))
+    metadata = {}
+    for response in responses:
+        for match in response['matches']:
+            if match.get('metadata') is not None:
+                metadata.setdefault(match['id'], match['metadata'])
+    missing = [id_ for id_ in ids if id_ not in metadata]
+    if missing:
+        metadata.update(await asyncio.to_thread(store.fetch, missing))
 
-def reconstruct_context(row, chunks_df):
-    context_pieces = []
-    current_row = row.copy()  # Create a copy to avoid modifying the original row
-    visited_ids = set()
-    
-    accumulated_score = current_row['combined_score']
-    
-    while True:
-        context_pieces.insert(0, current_row['text'])
-        parent_id = current_row.get('parent_id')
-        
-        # Check for termination conditions
-        if not parent_id or parent_id == current_row['chunk_id'] or parent_id in visited_ids:
-            break
-        
-        # Find the parent row
-        parent_rows = chunks_df[chunks_df['chunk_id'] == parent_id]
-        if parent_rows.empty:
-            #print(f"Warning: Parent chunk with ID {parent_id} not found for chunk {current_row['chunk_id']}")
-            break
-        
-        current_row = parent_rows.iloc[0]
-        visited_ids.add(parent_id)
-        # Accumulate the score
-        accumulated_score += current_row['normalized_likes']
-    
-    full_context = '\n'.join(context_pieces)
-    return full_context, accumulated_score
+    return [
+        {'matches': [
+            {'id': match['id'], 'score': match['score'], 'metadata': metadata[match['id']]}
+            for match in response['matches'] if match['id'] in metadata
+        ]}
+        for response in responses
+    ]
 
-def get_full_contexts(results_df, chunks_df):
-    # Apply the reconstruction and get both context and accumulated score
-    results = results_df.apply(lambda row: reconstruct_context(row, chunks_df), axis=1)
-    
-    # Unpack the results
-    results_df['full_context'], results_df['accumulated_score'] = zip(*results)
+def log_normalized_likes(likes, max_likes=None):
+    # log1p(likes) scaled by the largest like count, so one value is
+    # comparable across queries and a few viral chunks don't flatten the rest
+    likes = np.clip(pd.to_numeric(pd.Series(likes), errors='coerce').fillna(0).to_numpy(dtype=float), 0, None)
+    if max_likes is None:
+        max_likes = likes.max() if len(likes) else 0
+    scale = np.log1p(max_likes)
+    if not scale:
+        return np.zeros(len(likes))
+    return np.minimum(np.log1p(likes) / scale, 1.0)
 
-    return results_df
 
+def rerank_union(results, chunks_df, parent_index=None, top_n=None, likes_weight=0.5, similarity_weight=0.5, rrf_k=60):
+    # One rerank over the matches of every query. Each chunk's relevance is
+    # its reciprocal rank fusion score, the sum of 1 / (rrf_k + rank) over
+    # the queries that returned it, scaled by the best possible value; likes
+    # are log-scaled against the whole chunk set. Contexts are rebuilt only
+    # for the top_n chunks by combined score.
+    columns = ['query', 'chunk_id', 'score', 'text', 'level', 'likes', 'parent_id', 'duplicates']
+    rows = [
+        (query, match['id'], match['score'], match['metadata']['text'], match['metadata']['level'],
+         match['metadata']['likes'], match['metadata']['parent_id'], match['metadata'].get('duplicates', 1))
+        for query, res in enumerate(results) for match in res['matches']
+    ]
+    matches = pd.DataFrame.from_records(rows, columns=columns)
+    if matches.empty:
+        return matches.drop(columns='query').assign(rrf_score=[], queries=[], normalized_likes=[], combined_score=[], full_context=[], accumulated_score=[])
+
+    # 1-based rank within each query's response, best score first
+    matches = matches.sort_values(['query', 'score'], ascending=[True, False], kind='stable')
+    matches['rrf_score'] = 1.0 / (rrf_k + matches.groupby('query').cumcount() + 1)
+    grouped = matches.groupby('chunk_id', sort=False)
+    merged = grouped.first()
+    merged['score'] = grouped['score'].max()
+    merged['rrf_score'] = grouped['rrf_score'].sum()
+    merged['queries'] = grouped.size()
+    merged = merged.drop(columns='query').reset_index()
+
+    max_likes = np.nanmax([pd.to_numeric(chunks_df['likes'], errors='coerce').max(), pd.to_numeric(merged['likes'], errors='coerce').max()])
+    merged['normalized_likes'] = log_normalized_likes(merged['likes'], max_likes)
+    relevance = merged['rrf_score'] * (rrf_k + 1) / len(results)
+    merged['combined_score'] = likes_weight * merged['normalized_likes'] + similarity_weight * relevance
 
+    merged = merged.sort_values('combined_score', ascending=False, kind='stable')
+    if top_n is not None:
+        merged = merged.head(top_n)
+    return get_full_contexts(merged.reset_index(drop=True), chunks_df, parent_index)
+
+class ParentIndex:
+    # Precomputed ancestry for a chunk set. Chunk ids map to row positions
+    # once, every row gets its materialized ancestor path (nearest first,
+    # padded with -1) and the normalized likes summed over itself and its
+    # ancestors. Reconstructing contexts is then a gather over these arrays
+    # instead of a DataFrame scan per hop.
+    def __init__(self, chunks_df, max_depth=16):
+        chunks_df = chunks_df.drop_duplicates('chunk_id')
+        self.ids = pd.Index(chunks_df['chunk_id'].astype(str))
+        self.texts = chunks_df['text'].to_numpy(dtype=object)
+        self.levels = chunks_df['level'].to_numpy(dtype=object)
+        self.likes = chunks_df['likes'].to_numpy()
+        likes = chunks_df['normalized_likes'].to_numpy(dtype=float)
+
+        parent = self.ids.get_indexer(chunks_df['parent_id'].fillna('').astype(str))
+        own = np.arange(len(parent))
+        parent[parent == own] = -1
+
+        paths = [parent]
+        current = parent
+        for _ in range(max_depth - 1):
+            nxt = np.where(current >= 0, parent[current], -1)
+            # Cut cycles: stop as soon as an ancestor repeats
+            seen = np.column_stack([own] + paths)
+            nxt[(seen == nxt[:, None]).any(axis=1)] = -1
+            if (nxt < 0).all():
+                break
+            paths.append(nxt)
+            current = nxt
+        self.paths = np.column_stack(paths)
+        self.accumulated_likes = likes + np.where(self.paths >= 0, likes[self.paths], 0).sum(axis=1)
+        self._prefixes = {}
 
+    def positions(self, chunk_ids):
+        return self.ids.get_indexer(pd.Series(chunk_ids).fillna('').astype(str))
 
+    def prefix(self, position):
+        # Texts of the chunk at position and all its ancestors, root first
+        if position not in self._prefixes:
+            path = self.paths[position]
+            path = [position, *path[path >= 0]]
+            self._prefixes[position] = '\n'.join(self.texts[path[::-1]])
+        return self._prefixes[position]
+
+
+def get_full_contexts(results_df, chunks_df, parent_index=None):
+    # Build the index here when the caller has not precomputed one for chunks_df
+    if parent_index is None:
+        parent_index = ParentIndex(chunks_df)
+
+    parent_pos = parent_index.positions(results_df['parent_id'])
+    parent_pos[(results_df['parent_id'] == results_df['chunk_id']).to_numpy()] = -1
+    has_parent = parent_pos >= 0
+
+    # Context is the ancestor chain root first, then the matched chunk itself;
+    # the score accumulates the normalized likes of every ancestor.
+    results_df['full_context'] = [
+        parent_index.prefix(pos) + '\n' + text if pos >= 0 else text
+        for pos, text in zip(parent_pos, results_df['text'])
+    ]
+    results_df['accumulated_score'] = results_df['combined_score'].to_numpy() + np.where(
+        has_parent, parent_index.accumulated_likes[parent_pos], 0
+    )
+
+    return results_df
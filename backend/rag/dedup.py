@@ -0,0 +1,132 @@
+import os, re, unicodedata
+import numpy as np
+import pandas as pd
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+# Near-duplicate collapse for chunk sets. Every comment and reply gets a
+# MinHash signature over byte 4-grams of its normalized text; signatures are
+# split into bands and chunks sharing a band bucket become candidates, kept
+# when their estimated Jaccard similarity reaches DEDUP_THRESHOLD. Each
+# cluster is replaced by its most liked member carrying the summed likes and
+# the cluster size, so repeated comments are embedded, stored and prompted
+# once. DEDUP_THRESHOLD=0 disables the stage.
+DEDUP_THRESHOLD = float(os.getenv('DEDUP_THRESHOLD', '0.8'))
+SHINGLE_SIZE = 4
+NUM_PERMUTATIONS = 64
+# 16 bands of 4 rows: pairs at 0.8 similarity share a bucket with
+# probability above 0.999, pairs below 0.3 almost never do
+BAND_ROWS = 4
+SEED = 0
+
+_rng = np.random.default_rng(SEED)
+# Multiply-shift hash family: ((a * x + b) mod 2^64) >> 32, a odd
+_A = _rng.integers(1, 2**63, NUM_PERMUTATIONS, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+_B = _rng.integers(0, 2**63, NUM_PERMUTATIONS, dtype=np.uint64)
+_BAND_MIX = np.uint64(0x9E3779B97F4A7C15)
+_NON_WORD = re.compile(r'[\W_]+')
+
+
+def normalize_text(text):
+    # Case, punctuation, emoji and spacing don't make a comment different,
+    # unless they are all there is
+    text = unicodedata.normalize('NFKC', str(text)).casefold()
+    return ' '.join(_NON_WORD.sub(' ', text).split()) or ''.join(text.split())
+
+
+def minhash_signatures(texts, size=SHINGLE_SIZE):
+    # (len(texts), NUM_PERMUTATIONS) uint64 signatures. Shingles are the
+    # byte windows of each UTF-8 encoded text, built for all distinct texts
+    # at once from one concatenated buffer; texts shorter than a window are
+    # padded.
+    codes, uniques = pd.factorize(pd.Series([normalize_text(text) for text in texts], dtype=object))
+    encoded = [text.encode('utf-8').ljust(size) for text in uniques]
+    if not encoded:
+        return np.empty((0, NUM_PERMUTATIONS), dtype=np.uint64)
+    lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+    buffer = np.frombuffer(b''.join(encoded), dtype=np.uint8).astype(np.uint64)
+
+    n_windows = len(buffer) - size + 1
+    windows = np.zeros(n_windows, dtype=np.uint64)
+    for j in range(size):
+        windows = (windows << np.uint64(8)) | buffer[j:j + n_windows]
+    # Drop windows that run across the end of a text
+    starts = np.cumsum(lengths) - lengths
+    position = np.arange(len(buffer)) - np.repeat(starts, lengths)
+    windows = windows[(position <= np.repeat(lengths - size, lengths))[:n_windows]]
+    offsets = np.cumsum(lengths - size + 1) - (lengths - size + 1)
+
+    signatures = np.empty((len(encoded), NUM_PERMUTATIONS), dtype=np.uint64)
+    for i in range(NUM_PERMUTATIONS):
+        hashed = (_A[i] * windows + _B[i]) >> np.uint64(32)
+        signatures[:, i] = np.minimum.reduceat(hashed, offsets)
+    return signatures[codes]
+
+
+def near_duplicate_clusters(signatures, groups=None, threshold=DEDUP_THRESHOLD):
+    # Cluster label per row. Rows only cluster within the same group; in
+    # each band bucket every row is compared with the bucket's first row.
+    n = len(signatures)
+    groups = np.zeros(n, dtype=np.uint64) if groups is None else np.asarray(groups, dtype=np.uint64)
+    sources, targets = [], []
+    for band in range(0, NUM_PERMUTATIONS, BAND_ROWS):
+        keys = groups.copy()
+        for column in range(band, band + BAND_ROWS):
+            keys = keys * _BAND_MIX + signatures[:, column]
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        run_start = np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]
+        heads = order[np.maximum.accumulate(np.where(run_start, np.arange(n), 0))]
+        candidates = ~run_start
+        rows, heads = order[candidates], heads[candidates]
+        similar = (signatures[rows] == signatures[heads]).mean(axis=1) >= threshold
+        sources.append(rows[similar])
+        targets.append(heads[similar])
+    sources = np.concatenate(sources) if sources else np.empty(0, dtype=int)
+    targets = np.concatenate(targets) if targets else np.empty(0, dtype=int)
+    graph = coo_matrix((np.ones(len(sources), dtype=np.int8), (sources, targets)), shape=(n, n))
+    return connected_components(graph, directed=False)[1]
+
+
+def collapse_near_duplicates(chunks_df, threshold=None):
+    # chunks_df with near-duplicate comments and replies collapsed and a
+    # 'duplicates' column (1 for chunks that were not). Only leaf chunks of
+    # the same level are merged, so no surviving chunk loses its children
+    # and contexts are rebuilt from the representative's own ancestors.
+    threshold = DEDUP_THRESHOLD if threshold is None else threshold
+    chunks_df = chunks_df.reset_index(drop=True)
+    chunks_df['duplicates'] = 1
+    if not threshold or chunks_df.empty:
+        return chunks_df
+
+    parents = set(chunks_df['parent_id'].dropna().astype(str))
+    leaves = chunks_df[(chunks_df['level'] != 'post') & ~chunks_df['chunk_id'].astype(str).isin(parents)]
+    if len(leaves) < 2:
+        return chunks_df
+
+    signatures = minhash_signatures(leaves['text'].tolist())
+    levels = pd.factorize(leaves['level'])[0]
+    clusters = near_duplicate_clusters(signatures, levels, threshold)
+    if len(np.unique(clusters)) == len(leaves):
+        return chunks_df
+
+    leaves = leaves.assign(cluster=clusters)
+    grouped = leaves.groupby('cluster', sort=False)
+    sizes = grouped.size()
+    # The most liked member represents the cluster (the first on ties)
+    representatives = leaves.sort_values('likes', ascending=False, kind='stable').drop_duplicates('cluster')
+    keep = pd.Index(pd.Series(representatives.index, index=representatives['cluster'])[sizes.index])
+
+    chunks_df = chunks_df.drop(index=leaves.index.difference(keep))
+    chunks_df.loc[keep, 'likes'] = grouped['likes'].sum()[sizes.index].to_numpy()
+    chunks_df.loc[keep, 'duplicates'] = sizes.to_numpy()
+    if 'hashtags' in chunks_df:
+        # A collapsed chunk stays retrievable under every member's hashtags
+        multi = sizes.index[sizes.to_numpy() > 1]
+        members = leaves.loc[leaves['cluster'].isin(multi), ['cluster', 'hashtags']].explode('hashtags').dropna()
+        hashtags = members.drop_duplicates().sort_values(['cluster', 'hashtags']).groupby('cluster')['hashtags'].agg(list)
+        representative = pd.Series(representatives.index, index=representatives['cluster'])
+        chunks_df['hashtags'] = chunks_df['hashtags'].astype(object)
+        for cluster, tags in hashtags.items():
+            chunks_df.at[representative[cluster], 'hashtags'] = tags
+    return chunks_df
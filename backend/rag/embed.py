@@ -0,0 +1,66 @@
+import asyncio, openai, backoff
+from openai import AsyncOpenAI
+from utils.tokens import count_tokens
+from utils.metrics import record_tokens, retry_handler
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncEmbedder:
+    # Embeds a list of texts with the async OpenAI client. Batches are packed
+    # by token count (and capped by item count), at most max_concurrency
+    # requests are in flight at a time, failures are retried with async
+    # backoff, and the output is in the same order as the input.
+    def __init__(self, client=None, model="text-embedding-3-small", max_batch_tokens=100000,
+                 max_batch_items=2048, max_concurrency=4, max_tries=5):
+        self.client = client
+        self.model = model
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_items = max_batch_items
+        self.max_concurrency = max_concurrency
+        self.max_tries = max_tries
+
+    def pack(self, texts):
+        # Returns (start, end) slices over texts
+        batches = []
+        start, tokens = 0, 0
+        for i, text in enumerate(texts):
+            n = count_tokens(text, self.model)
+            if i > start and (tokens + n > self.max_batch_tokens or i - start >= self.max_batch_items):
+                batches.append((start, i))
+                start, tokens = i, 0
+            tokens += n
+        if start < len(texts):
+            batches.append((start, len(texts)))
+        return batches
+
+    async def _create(self, batch_texts):
+        if self.client is None:
+            self.client = AsyncOpenAI()
+        request = backoff.on_exception(
+            backoff.expo,
+            (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError),
+            max_tries=self.max_tries,
+            on_backoff=retry_handler('openai_embeddings'),
+        )(self.client.embeddings.create)
+        response = await request(input=batch_texts, model=self.model)
+        if getattr(response, 'usage', None) is not None:
+            record_tokens(self.model, 'embedding', response.usage.total_tokens)
+        return [data.embedding for data in response.data]
+
+    async def embed(self, texts):
+        texts = list(texts)
+        embeddings = [None] * len(texts)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def run(start, end):
+            async with semaphore:
+                try:
+                    embeddings[start:end] = await self._create(texts[start:end])
+                except Exception as e:
+                    print(f"Error generating embeddings for batch starting at index {start}: {e}")
+                    raise
+
+        await asyncio.gather(*(run(start, end) for start, end in self.pack(texts)))
+        return embeddings
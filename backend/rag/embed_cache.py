@@ -0,0 +1,42 @@
+import os, hashlib
+import numpy as np
+from utils.cache import DiskCache
+
+
+class EmbeddingCache:
+    # Content-addressed embedding cache: the key is (model, sha1(text)), so an
+    # unchanged post or comment is never sent to the embeddings API twice.
+    # Vectors are stored as raw float32 bytes.
+    def __init__(self, path, max_bytes=None):
+        self.store = DiskCache(path, max_bytes=max_bytes)
+
+    @staticmethod
+    def key(model, text):
+        return f"{model}:{hashlib.sha1(text.encode('utf-8')).hexdigest()}"
+
+    def get_many(self, texts, model):
+        # Returns one entry per text: the cached embedding or None on a miss.
+        keys = [self.key(model, text) for text in texts]
+        found = self.store.get_many(keys)
+        return [
+            np.frombuffer(found[key], dtype=np.float32).tolist() if key in found else None
+            for key in keys
+        ]
+
+    def set_many(self, texts, embeddings, model):
+        self.store.set_many({
+            self.key(model, text): np.asarray(embedding, dtype=np.float32).tobytes()
+            for text, embedding in zip(texts, embeddings)
+        })
+
+    def stats(self):
+        return self.store.stats()
+
+
+def get_embedding_cache():
+    # EMBEDDING_CACHE_PATH= (empty) disables the cache.
+    path = os.getenv('EMBEDDING_CACHE_PATH', '.cache/embeddings.sqlite')
+    if not path:
+        return None
+    max_mb = float(os.getenv('EMBEDDING_CACHE_MAX_MB', '2048'))
+    return EmbeddingCache(path, max_bytes=int(max_mb * 1024 * 1024))
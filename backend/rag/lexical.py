@@ -0,0 +1,175 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import CountVectorizer
+from rag.chunk import chunk_metadata
+from rag.store import field_values, filter_mask
+
+# Sparse lexical retrieval over a chunk set, next to the dense vector store.
+# Chunks are scored with BM25 over a sparse term matrix; responses have the
+# query_pinecone shape, so lexical matches can stand in for dense ones
+# (RETRIEVAL_MODE=lexical, no embedding call at all) or be fused with them
+# (hybrid_results).
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Share of the fused score that comes from the lexical side in hybrid mode
+HYBRID_LEXICAL_WEIGHT = float(os.getenv('HYBRID_LEXICAL_WEIGHT', '0.3'))
+# Indexes kept for the most recently seen chunk sets
+MAX_INDEXES = 4
+
+
+class LexicalIndex:
+    indexed_fields = ('hashtags', 'level', 'like_bucket')
+
+    def __init__(self, chunks_df, hashtags=None):
+        # hashtags tags chunks when chunks_df has no hashtags column, the way
+        # upsert_embeddings_to_pinecone does
+        chunks_df = chunks_df.drop_duplicates('chunk_id')
+        chunks_df = chunks_df[chunks_df['text'].fillna('').astype(str).str.strip() != '']
+        columns = ['chunk_id', 'parent_id', 'level', 'likes', 'text']
+        columns += [column for column in ('hashtags', 'duplicates') if column in chunks_df]
+        self.chunks = chunks_df[columns].reset_index(drop=True)
+        self.chunks['parent_id'] = self.chunks['parent_id'].fillna('')
+        self.chunks['likes'] = pd.to_numeric(self.chunks['likes'], errors='coerce').fillna(0)
+        if 'hashtags' not in self.chunks and hashtags:
+            self.chunks['hashtags'] = [sorted(hashtags)] * len(self.chunks)
+
+        self.vectorizer = CountVectorizer(stop_words='english', dtype=np.float32)
+        try:
+            counts = self.vectorizer.fit_transform(self.chunks['text'].astype(str)).tocsr()
+        except ValueError:
+            # Nothing but stop words
+            self.vectorizer = None
+            counts = None
+        if counts is not None:
+            # BM25 weight of every (chunk, term) pair, so a query is a single
+            # sparse product with its term indicator vector
+            n_docs = counts.shape[0]
+            doc_freq = np.bincount(counts.indices, minlength=counts.shape[1])
+            idf = np.log1p((n_docs - doc_freq + 0.5) / (doc_freq + 0.5)).astype(np.float32)
+            lengths = np.asarray(counts.sum(axis=1)).ravel()
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / max(lengths.mean(), 1e-9))
+            rows = np.repeat(np.arange(n_docs), np.diff(counts.indptr))
+            tf = counts.data
+            counts.data = (tf * (BM25_K1 + 1) / (tf + norm[rows]) * idf[counts.indices]).astype(np.float32)
+        self.weights = counts
+
+        self.postings = {field: {} for field in self.indexed_fields}
+        like_buckets = np.floor(np.log10(np.clip(self.chunks['likes'].to_numpy(dtype=float), 0, None) + 1)).astype(int)
+        self.chunks['like_bucket'] = like_buckets
+        for field in self.indexed_fields:
+            if field not in self.chunks:
+                continue
+            postings = self.postings[field]
+            for row, value in enumerate(self.chunks[field]):
+                for item in field_values(value):
+                    postings.setdefault(item, []).append(row)
+
+        # Match ids and the columns as plain lists, so match metadata never
+        # goes through a pandas row lookup; it is built on a row's first match
+        # and kept (row -> metadata)
+        self.ids = self.chunks['chunk_id'].astype(str).tolist()
+        self.columns = {column: self.chunks[column].tolist() for column in self.chunks}
+        self.row_metadata = {}
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def scores(self, queries):
+        # (chunks, queries) BM25 scores
+        if self.weights is None or not queries:
+            return np.zeros((len(self.chunks), len(queries)), dtype=np.float32)
+        terms = self.vectorizer.transform(queries)
+        terms.data[:] = 1
+        return (self.weights @ terms.T).toarray()
+
+    def query_many(self, queries, top_k=10, filter=None):
+        # One query_pinecone-style response per query text; chunks sharing no
+        # term with the query are never returned
+        scores = self.scores(list(queries))
+        if filter:
+            scores[~filter_mask(self.postings, filter, len(self.chunks))] = 0
+        responses = []
+        for column in scores.T:
+            rows = np.flatnonzero(column > 0)
+            if len(rows) > top_k:
+                rows = rows[np.argpartition(-column[rows], top_k - 1)[:top_k]]
+            rows = rows[np.argsort(-column[rows], kind='stable')]
+            responses.append({'matches': [
+                {'id': self.ids[row], 'score': float(column[row]), 'metadata': self.metadata(row)}
+                for row in rows
+            ]})
+        return responses
+
+    def metadata(self, row):
+        metadata = self.row_metadata.get(row)
+        if metadata is None:
+            metadata = chunk_metadata({column: values[row] for column, values in self.columns.items()})
+            self.row_metadata[row] = metadata
+        return metadata
+
+
+def chunk_set_key(chunks_df, hashtags=None):
+    hashed = pd.util.hash_pandas_object(chunks_df[['chunk_id', 'text', 'likes']].astype(str), index=False)
+    return (len(chunks_df), int(hashed.sum()), tuple(sorted(hashtags or [])))
+
+
+# chunk_set_key -> LexicalIndex, oldest first; get_lexical_index runs in
+# to_thread workers, so the dict is only touched under indexes_lock
+indexes = {}
+indexes_lock = threading.Lock()
+
+
+def get_lexical_index(chunks_df, hashtags=None):
+    # The index for chunks_df, reused while the same chunk set keeps coming
+    # back (precomputed hashtags, repeated requests)
+    key = chunk_set_key(chunks_df, hashtags)
+    with indexes_lock:
+        index = indexes.pop(key, None)
+    if index is None:
+        # Built outside the lock; two threads racing on a new chunk set
+        # both build it and the last one is kept
+        index = LexicalIndex(chunks_df, hashtags)
+    with indexes_lock:
+        indexes[key] = index
+        while len(indexes) > MAX_INDEXES:
+            indexes.pop(next(iter(indexes), None), None)
+    return index
+
+
+def normalize_scores(matches):
+    # Scores of one response scaled to [0, 1] by its own range
+    scores = np.array([match['score'] for match in matches], dtype=float)
+    if not len(scores):
+        return {}
+    low, high = scores.min(), scores.max()
+    scaled = (scores - low) / (high - low) if high > low else np.ones_like(scores)
+    return {match['id']: value for match, value in zip(matches, scaled)}
+
+
+def hybrid_results(dense_results, lexical_results, lexical_weight=None):
+    # Fuses dense and lexical responses query by query. Each side's scores
+    # are scaled to [0, 1] within the query, a chunk missing from one side
+    # scores 0 there, and the fused score replaces 'score'; the raw scores
+    # are kept as 'dense_score' and 'lexical_score'. Without dense results
+    # the lexical scores are only scaled.
+    lexical_weight = HYBRID_LEXICAL_WEIGHT if lexical_weight is None else lexical_weight
+    if dense_results is None:
+        dense_results = [{'matches': []} for _ in lexical_results]
+        lexical_weight = 1.0
+    fused = []
+    for dense, lexical in zip(dense_results, lexical_results):
+        dense_scaled = normalize_scores(dense['matches'])
+        lexical_scaled = normalize_scores(lexical['matches'])
+        matches = {}
+        for source, raw_key in ((dense, 'dense_score'), (lexical, 'lexical_score')):
+            for match in source['matches']:
+                entry = matches.setdefault(match['id'], {
+                    'id': match['id'], 'metadata': match['metadata'], 'dense_score': 0.0, 'lexical_score': 0.0
+                })
+                entry[raw_key] = match['score']
+        for id_, entry in matches.items():
+            entry['score'] = (1 - lexical_weight) * dense_scaled.get(id_, 0.0) + lexical_weight * lexical_scaled.get(id_, 0.0)
+        fused.append({'matches': sorted(matches.values(), key=lambda match: match['score'], reverse=True)})
+    return fused
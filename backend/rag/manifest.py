@@ -0,0 +1,114 @@
+import os, json, sqlite3, threading
+
+
+class UpsertManifest:
+    # Records chunk_id -> content hash for everything already written to a
+    # vector store, so an upsert only has to send new or changed chunks.
+    # Rows are also tagged with the scope they were written under (e.g. the
+    # hashtag set of a request) so chunks that vanish from that scope can be
+    # found and deleted without touching chunks owned by other scopes.
+    # The hashtags a chunk was written with are kept too, so a chunk shared
+    # by several hashtags keeps all of them whichever request rewrites it.
+    def __init__(self, path=':memory:'):
+        if path != ':memory:':
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS manifest (
+                chunk_id TEXT PRIMARY KEY,
+                hash TEXT,
+                hashtags TEXT
+            )
+        ''')
+        columns = {row[1] for row in self._conn.execute('PRAGMA table_info(manifest)')}
+        if 'hashtags' not in columns:
+            self._conn.execute('ALTER TABLE manifest ADD COLUMN hashtags TEXT')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS scopes (
+                scope TEXT,
+                chunk_id TEXT,
+                PRIMARY KEY (scope, chunk_id)
+            )
+        ''')
+        # release() looks chunks up across scopes
+        self._conn.execute('CREATE INDEX IF NOT EXISTS scopes_chunk_id ON scopes(chunk_id)')
+        self._conn.commit()
+
+    def changed(self, hashes, chunk=500):
+        # Returns the ids whose hash is unknown or differs from the manifest.
+        ids = list(hashes)
+        known = {}
+        with self._lock:
+            for i in range(0, len(ids), chunk):
+                batch = ids[i:i+chunk]
+                placeholders = ','.join('?' * len(batch))
+                known.update(self._conn.execute(
+                    f'SELECT chunk_id, hash FROM manifest WHERE chunk_id IN ({placeholders})', batch
+                ))
+        return [chunk_id for chunk_id, h in hashes.items() if known.get(chunk_id) != h]
+
+    def hashtags(self, chunk_ids, chunk=500):
+        # chunk_id -> hashtags recorded for it, for the ids that have any
+        ids = list(chunk_ids)
+        found = {}
+        with self._lock:
+            for i in range(0, len(ids), chunk):
+                batch = ids[i:i+chunk]
+                placeholders = ','.join('?' * len(batch))
+                found.update(self._conn.execute(
+                    f'SELECT chunk_id, hashtags FROM manifest WHERE chunk_id IN ({placeholders}) AND hashtags IS NOT NULL',
+                    batch
+                ))
+        return {chunk_id: json.loads(tags) for chunk_id, tags in found.items()}
+
+    def record(self, hashes, hashtags=None):
+        # hashtags maps chunk_id -> the hashtags it was written with
+        hashtags = hashtags or {}
+        with self._lock:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO manifest (chunk_id, hash, hashtags) VALUES (?, ?, ?)',
+                [
+                    (chunk_id, h, json.dumps(hashtags[chunk_id]) if chunk_id in hashtags else None)
+                    for chunk_id, h in hashes.items()
+                ]
+            )
+            self._conn.commit()
+
+    def tag(self, chunk_ids, scope):
+        with self._lock:
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO scopes (scope, chunk_id) VALUES (?, ?)',
+                [(scope, chunk_id) for chunk_id in chunk_ids]
+            )
+            self._conn.commit()
+
+    def stale(self, chunk_ids, scope):
+        # Ids recorded under scope that are no longer in chunk_ids.
+        present = set(chunk_ids)
+        with self._lock:
+            rows = self._conn.execute('SELECT chunk_id FROM scopes WHERE scope = ?', (scope,)).fetchall()
+        return [chunk_id for (chunk_id,) in rows if chunk_id not in present]
+
+    def release(self, chunk_ids, scope):
+        # Drops chunk_ids from scope and returns the ones no scope refers to
+        # any more; those are forgotten here and should be deleted from the
+        # store by the caller.
+        chunk_ids = list(chunk_ids)
+        with self._lock:
+            self._conn.executemany(
+                'DELETE FROM scopes WHERE scope = ? AND chunk_id = ?', [(scope, c) for c in chunk_ids]
+            )
+            orphaned = [
+                chunk_id for chunk_id in chunk_ids
+                if self._conn.execute('SELECT 1 FROM scopes WHERE chunk_id = ?', (chunk_id,)).fetchone() is None
+            ]
+            self._conn.executemany('DELETE FROM manifest WHERE chunk_id = ?', [(c,) for c in orphaned])
+            self._conn.commit()
+        return orphaned
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM manifest').fetchone()[0]
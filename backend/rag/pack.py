@@ -0,0 +1,112 @@
+import numpy as np
+from collections import defaultdict
+from utils.tokens import count_tokens
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def format_node(level, likes, text, depth, duplicates=1):
+    likes = int(likes) if likes == likes else 0
+    text = ' '.join(str(text).split())
+    # Collapsed near-duplicates (rag/dedup.py) say how many they stand for
+    similar = f" | {int(duplicates)} similar" if duplicates == duplicates and duplicates > 1 else ""
+    return f"{'  ' * depth}- [{level} | {likes} likes{similar}] {text}"
+
+
+def pack_contexts(results_df, parent_index, token_budget=20000, model="gpt-4o-2024-05-13", score_col=None):
+    # Serializes retrieved chunks as a post -> comment -> reply tree for the
+    # prompt. Results are taken greedily by score; each one costs the tokens
+    # of its own line plus any ancestor lines not already in the tree, and
+    # is skipped if that would exceed token_budget. Returns the packed text
+    # and the number of tokens it uses.
+    if score_col is None:
+        score_col = 'accumulated_score' if 'accumulated_score' in results_df else 'combined_score'
+    ranked = results_df.sort_values(score_col, ascending=False, kind='stable')
+
+    own_pos = parent_index.positions(ranked['chunk_id'])
+    parent_pos = parent_index.positions(ranked['parent_id'])
+
+    nodes = {}
+    children = defaultdict(list)
+    roots = []
+    used = 0
+    included = 0
+    for row, own, parent in zip(ranked.itertuples(index=False), own_pos, parent_pos):
+        # Ancestor chain root first, then the result itself
+        if own >= 0:
+            path = parent_index.paths[own]
+        elif parent >= 0 and parent_index.ids[parent] != row.chunk_id:
+            path = np.concatenate([[parent], parent_index.paths[parent]])
+        else:
+            path = np.empty(0, dtype=int)
+        chain = [
+            (parent_index.ids[p], parent_index.levels[p], parent_index.likes[p], parent_index.texts[p], 1)
+            for p in path[path >= 0][::-1]
+        ]
+        chain.append((row.chunk_id, row.level, row.likes, row.text, getattr(row, 'duplicates', 1)))
+
+        new = [(depth, node) for depth, node in enumerate(chain) if node[0] not in nodes]
+        if not new:
+            continue
+        lines = {node[0]: format_node(node[1], node[2], node[3], depth, node[4]) for depth, node in new}
+        cost = sum(count_tokens(line, model) for line in lines.values())
+        if used + cost > token_budget:
+            continue
+
+        for depth, node in new:
+            nodes[node[0]] = lines[node[0]]
+            if depth == 0:
+                roots.append(node[0])
+            else:
+                children[chain[depth - 1][0]].append(node[0])
+        used += cost
+        included += 1
+
+    out = []
+    stack = list(reversed(roots))
+    while stack:
+        key = stack.pop()
+        out.append(nodes[key])
+        stack.extend(reversed(children[key]))
+
+    logger.info(f"Packed {included}/{len(ranked)} contexts into {used} tokens ({len(nodes)} tree nodes)")
+    return '\n'.join(out), used
+
+
+def root_ids(results_df, parent_index):
+    # Chunk id of the top-most known ancestor (normally the post) per result
+    own_pos = parent_index.positions(results_df['chunk_id'])
+    parent_pos = parent_index.positions(results_df['parent_id'])
+    roots = []
+    for chunk_id, own, parent in zip(results_df['chunk_id'], own_pos, parent_pos):
+        start = own if own >= 0 else parent
+        if start < 0:
+            roots.append(chunk_id)
+            continue
+        path = parent_index.paths[start]
+        path = path[path >= 0]
+        roots.append(parent_index.ids[path[-1]] if len(path) else parent_index.ids[start])
+    return np.array(roots, dtype=object)
+
+
+def shard_contexts(results_df, parent_index, shard_budget=8000, max_shards=8, model="gpt-4o-2024-05-13", score_col=None):
+    # Splits results into up to max_shards packed context trees of at most
+    # shard_budget tokens each. Whole post trees are dealt round-robin in
+    # score order, so every shard gets a similar mix of strong and weak
+    # evidence and no post is split across shards. Returns a list of
+    # (text, tokens_used).
+    if score_col is None:
+        score_col = 'accumulated_score' if 'accumulated_score' in results_df else 'combined_score'
+    _, total = pack_contexts(results_df, parent_index, float('inf'), model, score_col)
+    n_shards = min(max_shards, max(1, -(-total // shard_budget)))
+
+    roots = root_ids(results_df, parent_index)
+    best = results_df[score_col].groupby(roots).max().sort_values(ascending=False, kind='stable')
+    shard_of_root = {root: i % n_shards for i, root in enumerate(best.index)}
+    shard = np.array([shard_of_root[root] for root in roots])
+
+    return [
+        pack_contexts(results_df[shard == i], parent_index, shard_budget, model, score_col)
+        for i in range(n_shards)
+    ]
@@ -0,0 +1,627 @@
+import os, json, time, threading, fcntl
+import numpy as np
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from pinecone import Pinecone, ServerlessSpec
+from rag.manifest import UpsertManifest
+import logging
+
+logger = logging.getLogger(__name__)
+
+DIMENSION = 1536
+
+# Long-lived pool for blocking vector store calls (per-vector queries,
+# metadata fetches), shared by every store and request
+query_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('VECTOR_QUERY_WORKERS', '8')), thread_name_prefix='vector-query'
+)
+
+
+class VectorStore:
+    # Minimal interface shared by every backend. Query responses follow the
+    # Pinecone shape ({'matches': [{'id', 'score', 'metadata'}]}) so the
+    # reranking code does not care which backend produced them.
+    dimension = DIMENSION
+    # chunk_id -> content hash of what has been written, see rag/manifest.py
+    manifest = None
+
+    def upsert(self, vectors, batch_size=300):
+        raise NotImplementedError
+
+    def query(self, vector, top_k=10, include_metadata=True, filter=None):
+        # filter is a Pinecone-style metadata filter, e.g.
+        # {'hashtags': {'$in': ['bag']}, 'like_bucket': {'$gte': 1}}
+        raise NotImplementedError
+
+    def query_many(self, vectors, top_k=10, filter=None):
+        # One response per vector with ids and scores, and metadata where the
+        # backend returns it without extra transfer; metadata for the rest of
+        # the matches is then read once with fetch()
+        return [self.query(vector, top_k=top_k, include_metadata=False, filter=filter) for vector in vectors]
+
+    def fetch(self, ids):
+        # chunk_id -> metadata for the ids present in the store
+        raise NotImplementedError
+
+    def delete(self, ids):
+        raise NotImplementedError
+
+    def refresh(self):
+        # Picks up writes made by another process (e.g. the ingestion
+        # worker); a no-op for backends that are always current.
+        pass
+
+
+class PineconeStore(VectorStore):
+    def __init__(self, index_name='tiktok-data', dimension=DIMENSION):
+        self.dimension = dimension
+        cloud = os.environ.get('PINECONE_CLOUD') or 'aws'
+        region = os.environ.get('PINECONE_REGION') or 'us-east-1'
+        spec = ServerlessSpec(cloud=cloud, region=region)
+        pc = Pinecone(api_key=os.getenv('PINECONE_API_KEY'))
+        existing_indexes = [
+            index_info["name"] for index_info in pc.list_indexes()
+        ]
+
+        # check if index already exists (it shouldn't if this is first time)
+        if index_name not in existing_indexes:
+            pc.create_index(
+                index_name,
+                dimension=dimension,
+                metric='dotproduct',
+                spec=spec
+            )
+            # wait for index to be initialized
+            while not pc.describe_index(index_name).status['ready']:
+                time.sleep(1)
+        self.index = pc.Index(index_name)
+
+    def upsert(self, vectors, batch_size=300):
+        for i in range(0, len(vectors), batch_size):
+            self.index.upsert(vectors=vectors[i:i+batch_size])
+
+    def query(self, vector, top_k=10, include_metadata=True, filter=None):
+        return self.index.query(vector=vector, top_k=top_k, include_metadata=include_metadata, filter=filter)
+
+    def query_many(self, vectors, top_k=10, filter=None):
+        # The index takes one vector per query, so the requests go out
+        # concurrently on the shared executor. Metadata comes back with the
+        # matches: fetch() would also download every vector's values.
+        responses = query_executor.map(
+            lambda vector: self.query(vector, top_k=top_k, include_metadata=True, filter=filter), vectors
+        )
+        return [
+            {'matches': [
+                {'id': match['id'], 'score': match['score'], 'metadata': match['metadata'] or {}}
+                for match in response['matches']
+            ]}
+            for response in responses
+        ]
+
+    def fetch(self, ids, batch_size=200):
+        # Ids travel in the query string, so batches are kept small. Pinecone
+        # returns the vector values too, so this is only for ids whose
+        # metadata did not come with a query.
+        ids = list(ids)
+        batches = [ids[i:i+batch_size] for i in range(0, len(ids), batch_size)]
+        metadata = {}
+        for response in query_executor.map(lambda batch: self.index.fetch(ids=batch), batches):
+            for id_, vector in response['vectors'].items():
+                metadata[id_] = vector['metadata'] or {}
+        return metadata
+
+    def delete(self, ids):
+        ids = list(ids)
+        for i in range(0, len(ids), 1000):
+            self.index.delete(ids=ids[i:i+1000])
+
+
+class LocalStore(VectorStore):
+    # In-process dot-product index. Vectors live in one contiguous float32
+    # matrix, so a query is a single matrix-vector product. With n_lists set,
+    # vectors are also partitioned into IVF lists by k-means and a query only
+    # scores the n_probe closest lists. Metadata fields in indexed_fields get
+    # an inverted index (value -> rows) so filtered queries only score
+    # matching rows.
+    #
+    # When a path is given the store is persisted there as a base (the matrix
+    # as .npy, memory-mapped back on load, and meta.json) plus append-only
+    # segments under segments/, one per save, holding only the rows upserted
+    # and the ids deleted since the previous save. Once the segments add up
+    # to segment_fraction of the base they are folded into a new base.
+    # Several processes (the API and the ingestion worker) can share a path:
+    # saves are serialised by a lock file, and every process applies the
+    # segments the others wrote before adding its own.
+    indexed_fields = ('hashtags', 'level', 'like_bucket')
+    # Candidate sets covering at least this share of the rows are scored
+    # against the whole matrix in place instead of being gathered into a copy
+    dense_fraction = 0.25
+    # Deleted rows are compacted away once they make up this share of the rows
+    compact_fraction = 0.25
+    # Segment rows (upserts and deletes), as a share of the base rows, at
+    # which a save rewrites the base instead; at least min_base_rows count
+    segment_fraction = 0.5
+    min_base_rows = 1024
+
+    def __init__(self, path=None, dimension=DIMENSION, n_lists=0, n_probe=8, autosave=True):
+        self.dimension = dimension
+        self.path = path
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.autosave = autosave
+        self._lock = threading.Lock()
+
+        self._vectors = np.zeros((0, dimension), dtype=np.float32)
+        self._size = 0
+        self._ids = []
+        self._metadata = []
+        self._alive = np.zeros(0, dtype=bool)
+        self._id_to_row = {}
+        self._postings = {field: {} for field in self.indexed_fields}
+        self._centroids = None
+        self._assignments = np.zeros(0, dtype=np.int32)
+        # mtime of meta.json (the base, written last) and number of the last
+        # segment as loaded or saved by this instance
+        self._base_version = None
+        self._segment = 0
+        # Rows in the base and in the segments on top of it
+        self._base_rows = 0
+        self._segment_rows = 0
+        # Ids upserted or deleted since the last save
+        self._upserted = set()
+        self._deleted = set()
+
+        if path and os.path.exists(os.path.join(path, 'vectors.npy')):
+            with self._file_lock(fcntl.LOCK_SH):
+                self.load()
+
+    def __len__(self):
+        return int(self._alive[:self._size].sum())
+
+    def _reserve(self, extra):
+        needed = self._size + extra
+        if needed <= self._vectors.shape[0] and self._vectors.flags.writeable:
+            return
+        capacity = max(needed, 2 * self._vectors.shape[0], 1024)
+        vectors = np.zeros((capacity, self.dimension), dtype=np.float32)
+        vectors[:self._size] = self._vectors[:self._size]
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:self._size] = self._alive[:self._size]
+        assignments = np.zeros(capacity, dtype=np.int32)
+        assignments[:self._size] = self._assignments[:self._size]
+        self._vectors, self._alive, self._assignments = vectors, alive, assignments
+
+    def upsert(self, vectors, batch_size=300):
+        # batch_size is accepted for interface compatibility; local writes
+        # are applied in one go.
+        if not vectors:
+            return
+        with self._lock:
+            self._apply(vectors)
+        if self.autosave and self.path:
+            self.save()
+
+    def _apply(self, vectors, track=True):
+        # track=False for writes read back from disk, which need no saving
+        self._reserve(len(vectors))
+        for vector in vectors:
+            row = self._id_to_row.get(vector['id'])
+            if row is None:
+                row = self._size
+                self._size += 1
+                self._ids.append(vector['id'])
+                self._metadata.append(None)
+                self._id_to_row[vector['id']] = row
+            self._vectors[row] = np.asarray(vector['values'], dtype=np.float32)
+            self._unindex(row, self._metadata[row])
+            self._metadata[row] = vector.get('metadata') or {}
+            self._index(row, self._metadata[row])
+            self._alive[row] = True
+            if self._centroids is not None:
+                self._assignments[row] = int(np.argmax(self._centroids @ self._vectors[row]))
+            if track:
+                self._upserted.add(vector['id'])
+                self._deleted.discard(vector['id'])
+        self._maybe_build_ivf()
+
+    def _maybe_build_ivf(self):
+        if self.n_lists and self._centroids is None and self._size >= self.n_lists * 39:
+            self._build_ivf()
+
+    def _index(self, row, metadata):
+        for field in self.indexed_fields:
+            for value in field_values(metadata.get(field)):
+                self._postings[field].setdefault(value, set()).add(row)
+
+    def _unindex(self, row, metadata):
+        if not metadata:
+            return
+        for field in self.indexed_fields:
+            for value in field_values(metadata.get(field)):
+                self._postings[field].get(value, set()).discard(row)
+
+    def _filter_mask(self, filter):
+        # Alive rows matching every condition of the filter
+        return self._alive[:self._size] & filter_mask(self._postings, filter, self._size)
+
+    def delete(self, ids):
+        with self._lock:
+            for id_ in ids:
+                row = self._id_to_row.get(id_)
+                if row is not None:
+                    self._alive[row] = False
+                    self._upserted.discard(id_)
+                    self._deleted.add(id_)
+            if self._size - self._alive[:self._size].sum() > self.compact_fraction * self._size:
+                self._compact()
+        if self.autosave and self.path:
+            self.save()
+
+    def _compact(self):
+        rows = np.flatnonzero(self._alive[:self._size])
+        self._vectors = self._vectors[rows]
+        self._assignments = self._assignments[rows]
+        self._alive = np.ones(len(rows), dtype=bool)
+        self._ids = [self._ids[r] for r in rows]
+        self._metadata = [self._metadata[r] for r in rows]
+        self._size = len(rows)
+        self._reindex()
+
+    def _reindex(self):
+        self._id_to_row = {id_: row for row, id_ in enumerate(self._ids)}
+        self._postings = {field: {} for field in self.indexed_fields}
+        for row, metadata in enumerate(self._metadata):
+            self._index(row, metadata)
+
+    def _build_ivf(self, n_iter=10, sample_size=100000, seed=0):
+        rng = np.random.default_rng(seed)
+        rows = np.flatnonzero(self._alive[:self._size])
+        if len(rows) > sample_size:
+            rows = rng.choice(rows, sample_size, replace=False)
+        sample = self._vectors[rows]
+        centroids = sample[rng.choice(len(sample), self.n_lists, replace=False)].copy()
+        # Spherical k-means: assign by dot product, renormalise the means.
+        for _ in range(n_iter):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            for k in range(self.n_lists):
+                members = sample[labels == k]
+                if len(members):
+                    centroid = members.mean(axis=0)
+                    norm = np.linalg.norm(centroid)
+                    centroids[k] = centroid / norm if norm else centroid
+        self._centroids = centroids
+        self._assignments[:self._size] = self._assign(self._vectors[:self._size])
+
+    def _assign(self, vectors, chunk=65536):
+        labels = np.empty(len(vectors), dtype=np.int32)
+        for i in range(0, len(vectors), chunk):
+            labels[i:i+chunk] = np.argmax(vectors[i:i+chunk] @ self._centroids.T, axis=1)
+        return labels
+
+    def _candidates(self, vector, filter=None):
+        alive = self._alive[:self._size] if not filter else self._filter_mask(filter)
+        if self._centroids is None:
+            return np.flatnonzero(alive)
+        probe = np.argsort(-(self._centroids @ vector))[:self.n_probe]
+        return np.flatnonzero(alive & np.isin(self._assignments[:self._size], probe))
+
+    def _score(self, queries, rows):
+        # (queries, rows) dot products. Large candidate sets are scored
+        # against the matrix view and their columns picked from the scores;
+        # only small ones (filters, IVF probes) gather their vectors.
+        if len(rows) >= self.dense_fraction * self._size:
+            return (queries @ self._vectors[:self._size].T)[:, rows]
+        return queries @ self._vectors[rows].T
+
+    def query(self, vector, top_k=10, include_metadata=True, filter=None):
+        # Reads hold the lock too: upsert, delete and refresh swap or resize
+        # the matrix, ids and postings from other threads.
+        vector = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            rows = self._candidates(vector, filter)
+            if len(rows) == 0:
+                return {'matches': []}
+            scores = self._score(vector[None, :], rows)[0]
+            k = min(top_k, len(rows))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            matches = []
+            for i in top:
+                row = rows[i]
+                match = {'id': self._ids[row], 'score': float(scores[i])}
+                if include_metadata:
+                    match['metadata'] = self._metadata[row]
+                matches.append(match)
+        return {'matches': matches}
+
+    def query_many(self, vectors, top_k=10, filter=None):
+        # Every query vector is scored in one matrix product over the
+        # candidate rows. With IVF the candidates are the union of the lists
+        # probed by any query, and rows outside a query's own probes are
+        # masked out of its ranking.
+        queries = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dimension)
+        if not len(queries):
+            return []
+        with self._lock:
+            alive = self._alive[:self._size] if not filter else self._filter_mask(filter)
+            allowed = None
+            if self._centroids is None:
+                rows = np.flatnonzero(alive)
+            else:
+                probes = np.argsort(-(queries @ self._centroids.T), axis=1)[:, :self.n_probe]
+                probed = np.zeros((len(queries), len(self._centroids)), dtype=bool)
+                probed[np.arange(len(queries))[:, None], probes] = True
+                rows = np.flatnonzero(alive & probed.any(axis=0)[self._assignments[:self._size]])
+                allowed = probed[:, self._assignments[rows]]
+            if len(rows) == 0:
+                return [{'matches': []} for _ in queries]
+
+            scores = self._score(queries, rows)
+            if allowed is not None:
+                scores[~allowed] = -np.inf
+            k = min(top_k, len(rows))
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            responses = []
+            for q, candidates in enumerate(top):
+                candidates = candidates[np.argsort(-scores[q, candidates])]
+                candidates = candidates[np.isfinite(scores[q, candidates])]
+                responses.append({'matches': [
+                    {'id': self._ids[rows[i]], 'score': float(scores[q, i])} for i in candidates
+                ]})
+        return responses
+
+    def fetch(self, ids):
+        metadata = {}
+        with self._lock:
+            for id_ in ids:
+                row = self._id_to_row.get(id_)
+                if row is not None and self._alive[row]:
+                    metadata[id_] = self._metadata[row]
+        return metadata
+
+    def save(self):
+        # Appends a segment with this instance's unsaved writes, or rewrites
+        # the base once the segments have grown too large, after catching up
+        # with whatever other processes saved.
+        with self._lock, self._file_lock(fcntl.LOCK_EX):
+            self._catch_up()
+            pending = len(self._upserted) + len(self._deleted)
+            if self._base_version is None or (
+                self._segment_rows + pending > self.segment_fraction * max(self._base_rows, self.min_base_rows)
+            ):
+                self._write_base()
+            elif pending:
+                self._write_segment()
+            self._upserted, self._deleted = set(), set()
+
+    def _write_base(self):
+        # Files are written next to the originals and swapped in with
+        # os.replace, so a memory-mapped matrix is never truncated under us.
+        # meta.json goes last and records the last segment folded in, so the
+        # segments it replaces are ignored even before they are removed.
+        rows = np.flatnonzero(self._alive[:self._size])
+        self._write('vectors.npy', lambda f: np.save(f, self._vectors[rows]))
+        if self._centroids is not None:
+            self._write('centroids.npy', lambda f: np.save(f, self._centroids))
+            self._write('assignments.npy', lambda f: np.save(f, self._assignments[rows]))
+        meta = {
+            'ids': [self._ids[r] for r in rows],
+            'metadata': [self._metadata[r] for r in rows],
+            'segment': self._segment,
+        }
+        self._write('meta.json', lambda f: f.write(json.dumps(meta).encode()))
+        for number in self._segment_numbers():
+            for suffix in ('.json', '.npy'):
+                os.remove(self._segment_path(number) + suffix)
+        self._base_version = self._disk_version()[0]
+        self._base_rows, self._segment_rows = len(rows), 0
+
+    def _write_segment(self):
+        # The .npy is written first: a segment exists once its .json does
+        upserted = [id_ for id_ in self._upserted if self._alive[self._id_to_row[id_]]]
+        rows = np.array([self._id_to_row[id_] for id_ in upserted], dtype=np.int64)
+        number = self._segment + 1
+        os.makedirs(os.path.join(self.path, 'segments'), exist_ok=True)
+        self._write(self._segment_path(number) + '.npy', lambda f: np.save(f, self._vectors[rows]))
+        segment = {
+            'ids': upserted,
+            'metadata': [self._metadata[r] for r in rows],
+            'deleted': sorted(self._deleted),
+        }
+        self._write(self._segment_path(number) + '.json', lambda f: f.write(json.dumps(segment).encode()))
+        self._segment = number
+        self._segment_rows += len(upserted) + len(self._deleted)
+
+    def _write(self, name, writer):
+        target = os.path.join(self.path, name)
+        tmp = target + '.tmp'
+        with open(tmp, 'wb') as f:
+            writer(f)
+        os.replace(tmp, target)
+
+    def _segment_path(self, number):
+        return os.path.join(self.path, 'segments', f'{number:08d}')
+
+    def _segment_numbers(self, after=0):
+        try:
+            names = os.listdir(os.path.join(self.path, 'segments'))
+        except FileNotFoundError:
+            return []
+        numbers = (int(name[:-5]) for name in names if name.endswith('.json') and name[:-5].isdigit())
+        return sorted(number for number in numbers if number > after)
+
+    @contextmanager
+    def _file_lock(self, operation):
+        # Advisory lock on <path>/lock, shared by every process using the path
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, 'lock'), 'a') as f:
+            fcntl.flock(f, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _disk_version(self):
+        # (mtime of meta.json or None, number of the newest segment)
+        try:
+            base = os.stat(os.path.join(self.path, 'meta.json')).st_mtime_ns
+        except FileNotFoundError:
+            return None, 0
+        numbers = self._segment_numbers()
+        return base, numbers[-1] if numbers else 0
+
+    def refresh(self):
+        if not self.path:
+            return
+        base, segment = self._disk_version()
+        if base is None or (base == self._base_version and segment <= self._segment):
+            return
+        with self._lock, self._file_lock(fcntl.LOCK_SH):
+            self._catch_up()
+
+    def _catch_up(self):
+        # Brings this instance up to date with the files: a new base is
+        # loaded in full, otherwise only the newer segments are applied.
+        # Unsaved upserts and deletes are replayed on top, so they win over
+        # what other processes wrote meanwhile.
+        base, segment = self._disk_version()
+        if base is None or (base == self._base_version and segment <= self._segment):
+            return
+        upserted = [
+            {'id': id_, 'values': np.array(self._vectors[row]), 'metadata': self._metadata[row]}
+            for id_, row in ((id_, self._id_to_row[id_]) for id_ in self._upserted)
+        ]
+        deleted = set(self._deleted)
+        if base != self._base_version:
+            self.load()
+        else:
+            self._apply_segments()
+        if upserted:
+            self._apply(upserted)
+        self._mark_deleted(deleted)
+        self._deleted = deleted
+
+    def _apply_segments(self):
+        for number in self._segment_numbers(after=self._segment):
+            path = self._segment_path(number)
+            with open(path + '.json') as f:
+                segment = json.load(f)
+            vectors = np.load(path + '.npy')
+            self._apply([
+                {'id': id_, 'values': vector, 'metadata': metadata}
+                for id_, vector, metadata in zip(segment['ids'], vectors, segment['metadata'])
+            ], track=False)
+            self._mark_deleted(segment['deleted'])
+            self._segment = number
+            self._segment_rows += len(segment['ids']) + len(segment['deleted'])
+
+    def _mark_deleted(self, ids):
+        for id_ in ids:
+            row = self._id_to_row.get(id_)
+            if row is not None:
+                self._alive[row] = False
+
+    def load(self):
+        # The matrix stays memory-mapped (read-only) until the first write,
+        # at which point _reserve copies it into a growable in-memory buffer.
+        self._base_version = self._disk_version()[0]
+        vectors = np.load(os.path.join(self.path, 'vectors.npy'), mmap_mode='r')
+        with open(os.path.join(self.path, 'meta.json')) as f:
+            meta = json.load(f)
+        self._vectors = vectors
+        self._size = len(vectors)
+        self._ids = meta['ids']
+        self._metadata = meta['metadata']
+        self._segment = meta.get('segment', 0)
+        self._base_rows, self._segment_rows = self._size, 0
+        self._alive = np.ones(self._size, dtype=bool)
+        self._reindex()
+        centroids_path = os.path.join(self.path, 'centroids.npy')
+        if os.path.exists(centroids_path):
+            self._centroids = np.load(centroids_path)
+            self._assignments = np.load(os.path.join(self.path, 'assignments.npy'))
+        else:
+            self._centroids = None
+            self._assignments = np.zeros(self._size, dtype=np.int32)
+        self._apply_segments()
+        # Stores saved before reaching the IVF threshold get their lists now
+        # rather than on the next upsert
+        self._maybe_build_ivf()
+
+
+def field_values(value):
+    # Indexed values of a metadata field; list fields index every element
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return value
+    return [value]
+
+
+def matching_values(postings, op, operand):
+    # Values of an indexed field that satisfy one filter operator
+    if op == '$eq':
+        return [operand] if operand in postings else []
+    if op == '$in':
+        return [value for value in operand if value in postings]
+    if op == '$ne':
+        return [value for value in postings if value != operand]
+    if op == '$nin':
+        return [value for value in postings if value not in operand]
+    comparisons = {
+        '$gt': lambda value: value > operand,
+        '$gte': lambda value: value >= operand,
+        '$lt': lambda value: value < operand,
+        '$lte': lambda value: value <= operand,
+    }
+    if op not in comparisons:
+        raise ValueError(f"Unsupported filter operator {op}")
+    return [
+        value for value in postings
+        if isinstance(value, (int, float)) and not isinstance(value, bool) and comparisons[op](value)
+    ]
+
+
+def filter_mask(postings, filter, size):
+    # Rows matching every condition of a metadata filter, given per-field
+    # postings (value -> rows)
+    mask = np.ones(size, dtype=bool)
+    for field, condition in filter.items():
+        field_postings = postings.get(field)
+        if field_postings is None:
+            raise ValueError(f"Metadata field {field} is not indexed for filtering")
+        if not isinstance(condition, dict):
+            condition = {'$eq': condition}
+        for op, operand in condition.items():
+            field_mask = np.zeros(size, dtype=bool)
+            for value in matching_values(field_postings, op, operand):
+                rows = field_postings[value]
+                if rows:
+                    field_mask[np.fromiter(rows, dtype=np.int64, count=len(rows))] = True
+            mask &= field_mask
+    return mask
+
+
+def get_vector_store():
+    # VECTOR_STORE=local runs retrieval in-process with no network access.
+    backend = os.getenv('VECTOR_STORE', 'pinecone')
+    # The upsert manifest lives next to the data it describes: inside the
+    # local index directory, in memory for a throwaway local index, and in
+    # the cache directory for a Pinecone index.
+    if backend == 'local':
+        path = os.getenv('LOCAL_INDEX_PATH') or None
+        store = LocalStore(
+            path=path,
+            n_lists=int(os.getenv('LOCAL_INDEX_NLISTS', '0')),
+            n_probe=int(os.getenv('LOCAL_INDEX_NPROBE', '8')),
+        )
+        store.manifest = UpsertManifest(os.path.join(path, 'manifest.sqlite') if path else ':memory:')
+        return store
+    if backend == 'pinecone':
+        index_name = os.getenv('PINECONE_INDEX', 'tiktok-data')
+        store = PineconeStore(index_name=index_name)
+        store.manifest = UpsertManifest(
+            os.getenv('UPSERT_MANIFEST_PATH', f'.cache/{index_name}-manifest.sqlite')
+        )
+        return store
+    raise ValueError(f"Unknown vector store backend: {backend}")
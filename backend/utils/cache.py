@@ -0,0 +1,179 @@
+import os, time, sqlite3, threading
+
+
+class DiskCache:
+    # Small persistent key/value cache on top of sqlite. Entries carry their
+    # size and last access time so the cache can be bounded by bytes and/or
+    # entry count and evicted least-recently-used first. sqlite's file
+    # locking makes one cache file safe to share between worker processes.
+    # Entry count and total size are kept in a one-row totals table by
+    # triggers, so bounding the cache never scans it.
+
+    # Access times of hits are buffered and written in batches of this many,
+    # or at least this often (seconds), and before every eviction
+    touch_batch = 1000
+    touch_interval = 30.0
+
+    def __init__(self, path, max_bytes=None, max_entries=None, ttl=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # key -> access time of hits not yet written
+        self._touched = {}
+        self._touched_at = time.time()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value BLOB,
+                size INTEGER,
+                created REAL,
+                accessed REAL
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS cache_accessed ON cache(accessed)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS cache_created ON cache(created)')
+        self._conn.commit()
+        # Totals are seeded from the table (once, for files created before
+        # they existed) in the same transaction that installs the triggers
+        self._conn.execute('BEGIN IMMEDIATE')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS totals (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                entries INTEGER,
+                bytes INTEGER
+            )
+        ''')
+        self._conn.execute(
+            'INSERT OR IGNORE INTO totals SELECT 0, COUNT(*), COALESCE(SUM(size), 0) FROM cache'
+        )
+        self._conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS cache_insert AFTER INSERT ON cache BEGIN
+                UPDATE totals SET entries = entries + 1, bytes = bytes + NEW.size;
+            END
+        ''')
+        self._conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS cache_delete AFTER DELETE ON cache BEGIN
+                UPDATE totals SET entries = entries - 1, bytes = bytes - OLD.size;
+            END
+        ''')
+        self._conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS cache_resize AFTER UPDATE OF size ON cache BEGIN
+                UPDATE totals SET bytes = bytes - OLD.size + NEW.size;
+            END
+        ''')
+        self._conn.commit()
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def set(self, key, value):
+        self.set_many({key: value})
+
+    def get_many(self, keys, chunk=500):
+        # Returns {key: value} for the keys that are present and not expired.
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        now = time.time()
+        with self._lock:
+            for i in range(0, len(keys), chunk):
+                batch = keys[i:i+chunk]
+                placeholders = ','.join('?' * len(batch))
+                rows = self._conn.execute(
+                    f'SELECT key, value, created FROM cache WHERE key IN ({placeholders})', batch
+                ).fetchall()
+                for key, value, created in rows:
+                    if self.ttl is None or now - created <= self.ttl:
+                        found[key] = value
+            for key in found:
+                self._touched[key] = now
+            if len(self._touched) >= self.touch_batch or now - self._touched_at >= self.touch_interval:
+                self._flush_touched(now)
+                self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def set_many(self, items):
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            # An upsert rather than INSERT OR REPLACE, whose implicit delete
+            # would bypass the totals triggers
+            self._conn.executemany(
+                'INSERT INTO cache (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET value = excluded.value, size = excluded.size, '
+                'created = excluded.created, accessed = excluded.accessed',
+                [(key, value, len(value), now, now) for key, value in items.items()]
+            )
+            for key in items:
+                self._touched.pop(key, None)
+            self._flush_touched(now)
+            self._evict(now)
+            self._conn.commit()
+
+    def _flush_touched(self, now):
+        if self._touched:
+            self._conn.executemany(
+                'UPDATE cache SET accessed = ? WHERE key = ?', [(t, key) for key, t in self._touched.items()]
+            )
+            self._touched = {}
+        self._touched_at = now
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM cache')
+            self._conn.commit()
+
+    def _evict(self, now):
+        if self.ttl is not None:
+            self._conn.execute('DELETE FROM cache WHERE created < ?', (now - self.ttl,))
+        count, total = self._totals()
+        excess_entries = count - self.max_entries if self.max_entries else 0
+        if excess_entries > 0:
+            self._conn.execute(
+                'DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed LIMIT ?)',
+                (excess_entries,)
+            )
+            total = self._totals()[1]
+        if self.max_bytes and total > self.max_bytes:
+            # Walk entries oldest-first until enough bytes have been freed.
+            to_free = total - self.max_bytes
+            victims = []
+            for key, size in self._conn.execute('SELECT key, size FROM cache ORDER BY accessed'):
+                victims.append((key,))
+                to_free -= size
+                if to_free <= 0:
+                    break
+            self._conn.executemany('DELETE FROM cache WHERE key = ?', victims)
+
+    def _totals(self):
+        return self._conn.execute('SELECT entries, bytes FROM totals').fetchone()
+
+    def stats(self):
+        with self._lock:
+            count, total = self._totals()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': count,
+            'bytes': total,
+        }
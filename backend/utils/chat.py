@@ -1,6 +1,69 @@
-import openai, asyncio,backoff
+import openai, asyncio,backoff, os, json, hashlib
+import httpx
+from utils.cache import DiskCache
+from utils.metrics import record_tokens, retry_handler
 
-@backoff.on_exception(backoff.expo, (openai.RateLimitError, openai.APITimeoutError))
+try:
+    import anthropic
+except ImportError:
+    anthropic = None
+
+# Per-call timeout (seconds) and connection pool size for the shared async clients
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', '120'))
+LLM_MAX_CONNECTIONS = int(os.getenv('LLM_MAX_CONNECTIONS', '20'))
+
+RETRY_ERRORS = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError)
+if anthropic is not None:
+    RETRY_ERRORS += (anthropic.RateLimitError, anthropic.APITimeoutError, anthropic.APIConnectionError)
+
+# Persistent response cache keyed on everything that determines a completion
+# (LLM_CACHE_PATH= disables it, use_cache=False bypasses it per call)
+LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH', '.cache/llm.sqlite')
+llm_cache = DiskCache(
+    LLM_CACHE_PATH,
+    max_entries=int(os.getenv('LLM_CACHE_MAX_ENTRIES', '10000')),
+    ttl=float(os.getenv('LLM_CACHE_TTL', str(7 * 24 * 3600))),
+) if LLM_CACHE_PATH else None
+
+def llm_cache_key(model, system_message, msg_history, msg, temperature, n_responses=1, seed=0):
+    payload = json.dumps(
+        [model, system_message, msg_history, msg, temperature, n_responses, seed],
+        sort_keys=True, default=str
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def record_usage(model, usage):
+    # OpenAI reports prompt/completion tokens, Anthropic input/output tokens
+    if usage is None:
+        return
+    record_tokens(model, 'llm_prompt', getattr(usage, 'prompt_tokens', None) or getattr(usage, 'input_tokens', 0))
+    record_tokens(model, 'llm_completion', getattr(usage, 'completion_tokens', None) or getattr(usage, 'output_tokens', 0))
+
+def get_llm_cache_stats():
+    return llm_cache.stats() if llm_cache is not None else {}
+
+# One async client per provider, shared by every request so connections are pooled
+async_clients = {}
+
+def get_async_client(model):
+    provider = "anthropic" if "claude" in model else "openai"
+    if provider not in async_clients:
+        limits = httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS)
+        if provider == "anthropic":
+            if anthropic is None:
+                raise ValueError(f"Model {model} requires the anthropic package.")
+            async_clients[provider] = anthropic.AsyncAnthropic(
+                timeout=LLM_TIMEOUT, max_retries=0,
+                http_client=anthropic.DefaultAsyncHttpxClient(limits=limits),
+            )
+        else:
+            async_clients[provider] = openai.AsyncOpenAI(
+                timeout=LLM_TIMEOUT, max_retries=0,
+                http_client=openai.DefaultAsyncHttpxClient(limits=limits),
+            )
+    return async_clients[provider]
+
+@backoff.on_exception(backoff.expo, (openai.RateLimitError, openai.APITimeoutError), on_backoff=retry_handler('llm'))
 def get_batch_responses_from_llm(
     msg,
     client,
@@ -10,9 +73,16 @@ def get_batch_responses_from_llm(
     msg_history=None,
     temperature=0.75,
     n_responses=1,
+    use_cache=True,
 ):
     if msg_history is None:
         msg_history = []
+    key = None
+    if use_cache and llm_cache is not None:
+        key = llm_cache_key(model, system_message, msg_history, msg, temperature, n_responses)
+        cached = llm_cache.get(key)
+        if cached is not None:
+            return tuple(json.loads(cached))
 
     if model in [
         "gpt-4o-2024-05-13",
@@ -32,6 +102,7 @@ def get_batch_responses_from_llm(
             stop=None,
             seed=0,
         )
+        record_usage(model, getattr(response, 'usage', None))
         content = [r.message.content for r in response.choices]
         new_msg_history = [
             new_msg_history + [{"role": "assistant", "content": c}] for c in content
@@ -47,6 +118,7 @@ def get_batch_responses_from_llm(
                 print_debug=False,
                 msg_history=None,
                 temperature=temperature,
+                use_cache=False,
             )
             content.append(c)
             new_msg_history.append(hist)
@@ -63,9 +135,11 @@ def get_batch_responses_from_llm(
         print("*" * 21 + " LLM END " + "*" * 21)
         print()
 
+    if key is not None:
+        llm_cache.set(key, json.dumps([content, new_msg_history]).encode('utf-8'))
     return content, new_msg_history
 
-@backoff.on_exception(backoff.expo, (openai.RateLimitError, openai.APITimeoutError))
+@backoff.on_exception(backoff.expo, (openai.RateLimitError, openai.APITimeoutError), on_backoff=retry_handler('llm'))
 def get_response_from_llm(
     msg,
     client,
@@ -74,9 +148,16 @@ def get_response_from_llm(
     print_debug=False,
     msg_history=None,
     temperature=0.75,
+    use_cache=True,
 ):
     if msg_history is None:
         msg_history = []
+    key = None
+    if use_cache and llm_cache is not None:
+        key = llm_cache_key(model, system_message, msg_history, msg, temperature)
+        cached = llm_cache.get(key)
+        if cached is not None:
+            return tuple(json.loads(cached))
 
     if "claude" in model:
         new_msg_history = msg_history + [
@@ -97,6 +178,7 @@ def get_response_from_llm(
             system=system_message,
             messages=new_msg_history,
         )
+        record_usage(model, getattr(response, 'usage', None))
         content = response.content[0].text
         new_msg_history = new_msg_history + [
             {
@@ -127,6 +209,188 @@ def get_response_from_llm(
             stop=None,
             seed=0,
         )
+        record_usage(model, getattr(response, 'usage', None))
+        content = response.choices[0].message.content
+        new_msg_history = new_msg_history + [{"role": "assistant", "content": content}]
+    else:
+        raise ValueError(f"Model {model} not supported.")
+
+    if print_debug:
+        print()
+        print("*" * 20 + " LLM START " + "*" * 20)
+        for j, msg in enumerate(new_msg_history):
+            print(f'{j}, {msg["role"]}: {msg["content"]}')
+        print(content)
+        print("*" * 21 + " LLM END " + "*" * 21)
+        print()
+
+    if key is not None:
+        llm_cache.set(key, json.dumps([content, new_msg_history]).encode('utf-8'))
+    return content, new_msg_history
+
+
+# Async counterparts of the functions above. They await the provider's async
+# client (the shared one from get_async_client when client is None), so a
+# slow completion never blocks the event loop, and backoff sleeps with
+# asyncio.sleep between retries.
+@backoff.on_exception(backoff.expo, RETRY_ERRORS, max_tries=6, on_backoff=retry_handler('llm'))
+async def get_batch_responses_from_llm_async(
+    msg,
+    client,
+    model,
+    system_message,
+    print_debug=False,
+    msg_history=None,
+    temperature=0.75,
+    n_responses=1,
+    timeout=None,
+    use_cache=True,
+):
+    if msg_history is None:
+        msg_history = []
+    if client is None:
+        client = get_async_client(model)
+    key = None
+    if use_cache and llm_cache is not None:
+        key = llm_cache_key(model, system_message, msg_history, msg, temperature, n_responses)
+        cached = await asyncio.to_thread(llm_cache.get, key)
+        if cached is not None:
+            return tuple(json.loads(cached))
+
+    if model in [
+        "gpt-4o-2024-05-13",
+        "gpt-4o-mini-2024-07-18",
+        "gpt-4o-2024-08-06",
+    ]:
+        new_msg_history = msg_history + [{"role": "user", "content": msg}]
+        response = await client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": system_message},
+                *new_msg_history,
+            ],
+            temperature=temperature,
+            max_tokens=3000,
+            n=n_responses,
+            stop=None,
+            seed=0,
+            timeout=timeout or LLM_TIMEOUT,
+        )
+        record_usage(model, getattr(response, 'usage', None))
+        content = [r.message.content for r in response.choices]
+        new_msg_history = [
+            new_msg_history + [{"role": "assistant", "content": c}] for c in content
+        ]
+    elif "claude" in model:
+        results = await asyncio.gather(*[
+            get_response_from_llm_async(
+                msg,
+                client,
+                model,
+                system_message,
+                print_debug=False,
+                msg_history=None,
+                temperature=temperature,
+                timeout=timeout,
+                use_cache=False,
+            )
+            for _ in range(n_responses)
+        ])
+        content = [c for c, _ in results]
+        new_msg_history = [hist for _, hist in results]
+    else:
+        raise ValueError(f"Model {model} not supported.")
+
+    if print_debug:
+        # Just print the first one.
+        print()
+        print("*" * 20 + " LLM START " + "*" * 20)
+        for j, msg in enumerate(new_msg_history[0]):
+            print(f'{j}, {msg["role"]}: {msg["content"]}')
+        print(content)
+        print("*" * 21 + " LLM END " + "*" * 21)
+        print()
+
+    if key is not None:
+        await asyncio.to_thread(llm_cache.set, key, json.dumps([content, new_msg_history]).encode('utf-8'))
+    return content, new_msg_history
+
+@backoff.on_exception(backoff.expo, RETRY_ERRORS, max_tries=6, on_backoff=retry_handler('llm'))
+async def get_response_from_llm_async(
+    msg,
+    client,
+    model,
+    system_message,
+    print_debug=False,
+    msg_history=None,
+    temperature=0.75,
+    timeout=None,
+    use_cache=True,
+):
+    if msg_history is None:
+        msg_history = []
+    if client is None:
+        client = get_async_client(model)
+    key = None
+    if use_cache and llm_cache is not None:
+        key = llm_cache_key(model, system_message, msg_history, msg, temperature)
+        cached = await asyncio.to_thread(llm_cache.get, key)
+        if cached is not None:
+            return tuple(json.loads(cached))
+
+    if "claude" in model:
+        new_msg_history = msg_history + [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": msg,
+                    }
+                ],
+            }
+        ]
+        response = await client.messages.create(
+            model=model,
+            max_tokens=3000,
+            temperature=temperature,
+            system=system_message,
+            messages=new_msg_history,
+            timeout=timeout or LLM_TIMEOUT,
+        )
+        record_usage(model, getattr(response, 'usage', None))
+        content = response.content[0].text
+        new_msg_history = new_msg_history + [
+            {
+                "role": "assistant",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": content,
+                    }
+                ],
+            }
+        ]
+    elif model in [
+        "gpt-4o-2024-05-13",
+        "gpt-4o-mini-2024-07-18",
+        "gpt-4o-2024-08-06",
+    ]:
+        new_msg_history = msg_history + [{"role": "user", "content": msg}]
+        response = await client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": system_message},
+                *new_msg_history,
+            ],
+            temperature=temperature,
+            max_tokens=3000,
+            n=1,
+            stop=None,
+            seed=0,
+            timeout=timeout or LLM_TIMEOUT,
+        )
+        record_usage(model, getattr(response, 'usage', None))
         content = response.choices[0].message.content
         new_msg_history = new_msg_history + [{"role": "assistant", "content": content}]
     else:
@@ -141,4 +405,92 @@ def get_response_from_llm(
         print("*" * 21 + " LLM END " + "*" * 21)
         print()
 
-    return content, new_msg_history
\ No newline at end of file
+    if key is not None:
+        await asyncio.to_thread(llm_cache.set, key, json.dumps([content, new_msg_history]).encode('utf-8'))
+    return content, new_msg_history
+
+async def stream_response_from_llm_async(
+    msg,
+    client,
+    model,
+    system_message,
+    msg_history=None,
+    temperature=0.75,
+    timeout=None,
+    use_cache=True,
+):
+    # Yields the completion text as it is generated. Retries are not applied
+    # here since a partially consumed stream cannot be replayed.
+    if msg_history is None:
+        msg_history = []
+    if client is None:
+        client = get_async_client(model)
+    key = None
+    if use_cache and llm_cache is not None:
+        key = llm_cache_key(model, system_message, msg_history, msg, temperature)
+        cached = await asyncio.to_thread(llm_cache.get, key)
+        if cached is not None:
+            yield json.loads(cached)[0]
+            return
+
+    pieces = []
+    if "claude" in model:
+        new_msg_history = msg_history + [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": msg,
+                    }
+                ],
+            }
+        ]
+        async with client.messages.stream(
+            model=model,
+            max_tokens=3000,
+            temperature=temperature,
+            system=system_message,
+            messages=new_msg_history,
+            timeout=timeout or LLM_TIMEOUT,
+        ) as stream:
+            async for text in stream.text_stream:
+                pieces.append(text)
+                yield text
+            record_usage(model, (await stream.get_final_message()).usage)
+        assistant_msg = {"role": "assistant", "content": [{"type": "text", "text": ''.join(pieces)}]}
+    elif model in [
+        "gpt-4o-2024-05-13",
+        "gpt-4o-mini-2024-07-18",
+        "gpt-4o-2024-08-06",
+    ]:
+        new_msg_history = msg_history + [{"role": "user", "content": msg}]
+        stream = await client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": system_message},
+                *new_msg_history,
+            ],
+            temperature=temperature,
+            max_tokens=3000,
+            n=1,
+            stop=None,
+            seed=0,
+            stream=True,
+            stream_options={"include_usage": True},
+            timeout=timeout or LLM_TIMEOUT,
+        )
+        async for chunk in stream:
+            if getattr(chunk, 'usage', None) is not None:
+                record_usage(model, chunk.usage)
+            if chunk.choices and chunk.choices[0].delta.content:
+                pieces.append(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+        assistant_msg = {"role": "assistant", "content": ''.join(pieces)}
+    else:
+        raise ValueError(f"Model {model} not supported.")
+
+    # Only a fully consumed stream is cached
+    if key is not None:
+        value = json.dumps([''.join(pieces), new_msg_history + [assistant_msg]]).encode('utf-8')
+        await asyncio.to_thread(llm_cache.set, key, value)
@@ -1,4 +1,5 @@
-import psycopg2, asyncpg, asyncio, os, pandas as pd
+import psycopg2, asyncpg, asyncio, os, time, pandas as pd
+from utils.metrics import record_items
 from collections import defaultdict
 from dotenv import load_dotenv
 load_dotenv()
@@ -12,62 +13,195 @@ USER = os.getenv('USER_POSTGRE')
 PASSWORD = os.getenv('password')
 
 
-async def create_pool():
+HASHTAG_QUERY = '''
+    SELECT 
+        p.aweme_id AS post_id,
+        p.description AS post_description,
+        p.statistics_digg_count AS post_likes,
+        p.hashtag_keyword AS hashtag,
+        c.cid AS comment_id,
+        c.text AS comments,
+        c.digg_count AS comment_likes,
+        r.text AS replies,
+        r.digg_count AS reply_likes
+    FROM tiktok_posts p
+    LEFT JOIN tiktok_comments c ON p.aweme_id = c.aweme_id AND c.digg_count >= $3
+    LEFT JOIN tiktok_comments_replies r ON c.cid = r.reply_id
+    WHERE p.hashtag_keyword = ANY($1)
+      AND p.statistics_play_count >= $2
+    ORDER BY p.statistics_play_count DESC
+'''
+
+# HASHTAG_QUERY restricted to posts newer than a watermark post id ($4), used
+# by the offline ingestion worker to pull only what it has not seen yet
+NEW_POSTS_QUERY = '''
+    SELECT 
+        p.aweme_id AS post_id,
+        p.description AS post_description,
+        p.statistics_digg_count AS post_likes,
+        p.hashtag_keyword AS hashtag,
+        c.cid AS comment_id,
+        c.text AS comments,
+        c.digg_count AS comment_likes,
+        r.text AS replies,
+        r.digg_count AS reply_likes
+    FROM tiktok_posts p
+    LEFT JOIN tiktok_comments c ON p.aweme_id = c.aweme_id AND c.digg_count >= $3
+    LEFT JOIN tiktok_comments_replies r ON c.cid = r.reply_id
+    WHERE p.hashtag_keyword = ANY($1)
+      AND p.statistics_play_count >= $2
+      AND p.aweme_id > $4
+    ORDER BY p.aweme_id
+'''
+
+# Application-wide pool, opened and closed by the FastAPI lifespan. Queries
+# go through asyncpg's per-connection statement cache, so each is prepared
+# once per connection and dropped with it.
+pool = None
+# Pool wait and query timings, see get_pool_stats()
+POOL_STATS = {
+    'acquires': 0,
+    'wait_seconds_total': 0.0,
+    'wait_seconds_max': 0.0,
+    'queries': 0,
+    'query_seconds_total': 0.0,
+    'query_seconds_max': 0.0,
+}
+
+
+# Kept as Python objects: a bigint id column with NULLs from the LEFT JOINs
+# would otherwise be inferred as float64 and lose precision
+ID_COLUMNS = ('post_id', 'comment_id')
+
+def records_to_frame(records, columns):
+    df = pd.DataFrame.from_records(records, columns=columns)
+    for col in ID_COLUMNS:
+        if col in df and df[col].dtype.kind == 'f':
+            df[col] = pd.Series([record[col] for record in records], dtype=object)
+    return df
+
+async def create_pool(min_size=None, max_size=None):
     return await asyncpg.create_pool(
         host=HOST,
         port=PORT,
         database=DATABASE,
         user=USER,
         password=PASSWORD,
-        min_size=1,
-        max_size=10
+        min_size=min_size or int(os.getenv('DB_POOL_MIN_SIZE', '1')),
+        max_size=max_size or int(os.getenv('DB_POOL_MAX_SIZE', '10')),
     )
 
-async def get_data(words, min_play_count=50000, min_comment_likes=5):
-    # Prepare SQL query with joins
+async def init_pool(min_size=None, max_size=None):
+    global pool
+    if pool is None:
+        pool = await create_pool(min_size, max_size)
+    return pool
+
+async def close_pool():
+    global pool
+    if pool is not None:
+        await pool.close()
+        pool = None
+
+def record_timing(kind, seconds):
+    count_key = 'acquires' if kind == 'wait' else 'queries'
+    POOL_STATS[count_key] += 1
+    POOL_STATS[f'{kind}_seconds_total'] += seconds
+    POOL_STATS[f'{kind}_seconds_max'] = max(POOL_STATS[f'{kind}_seconds_max'], seconds)
+
+def get_pool_stats():
+    stats = dict(POOL_STATS)
+    stats['wait_seconds_avg'] = stats['wait_seconds_total'] / stats['acquires'] if stats['acquires'] else 0.0
+    stats['query_seconds_avg'] = stats['query_seconds_total'] / stats['queries'] if stats['queries'] else 0.0
+    if pool is not None:
+        stats['pool_size'] = pool.get_size()
+        stats['pool_idle'] = pool.get_idle_size()
+        stats['pool_min_size'] = pool.get_min_size()
+        stats['pool_max_size'] = pool.get_max_size()
+    return stats
+
+async def get_snapshot_version(words, min_play_count=50000):
+    # Cheap fingerprint of the posts behind a hashtag set; it changes when
+    # new posts land, which invalidates results cached under the old one
     query = '''
-        SELECT 
-            p.aweme_id AS post_id,
-            p.description AS post_description,
-            p.statistics_digg_count AS post_likes,
-            c.cid AS comment_id,
-            c.text AS comments,
-            c.digg_count AS comment_likes,
-            r.text AS replies,
-            r.digg_count AS reply_likes
+        SELECT COUNT(*) AS posts, MAX(p.aweme_id)::text AS latest
         FROM tiktok_posts p
-        LEFT JOIN tiktok_comments c ON p.aweme_id = c.aweme_id AND c.digg_count >= $3
-        LEFT JOIN tiktok_comments_replies r ON c.cid = r.reply_id
         WHERE p.hashtag_keyword = ANY($1)
           AND p.statistics_play_count >= $2
-        ORDER BY p.statistics_play_count DESC
     '''
-
-    pool = await create_pool()
+    if pool is None:
+        return None
     try:
         async with pool.acquire() as connection:
-            # Fetch all records
-            records = await connection.fetch(query, words, min_play_count, min_comment_likes)
+            row = await connection.fetchrow(query, words, min_play_count)
+            return f"{row['posts']}:{row['latest']}"
+    except Exception as e:
+        print(f"Error during snapshot lookup: {e}")
+        return None
+
+async def get_data(words, min_play_count=50000, min_comment_likes=5, save_csv=False):
+    # Use the application pool when the app is running, otherwise (scripts)
+    # open a temporary one for this call
+    owns_pool = pool is None
+    active_pool = await create_pool() if owns_pool else pool
+    try:
+        start = time.perf_counter()
+        async with active_pool.acquire() as connection:
+            record_timing('wait', time.perf_counter() - start)
+
+            # Fetch all records (prepared once per connection by asyncpg)
+            start = time.perf_counter()
+            records = await connection.fetch(HASHTAG_QUERY, words, min_play_count, min_comment_likes)
+            record_timing('query', time.perf_counter() - start)
+            record_items('get_data', 'rows', len(records))
             if not records:
                 return pd.DataFrame()
 
-            # Convert records to list of dictionaries
-            data = [dict(record) for record in records]
-
             # Create DataFrame
-            df = pd.DataFrame(data)
+            df = records_to_frame(records, list(records[0].keys()))
 
-            # Handle missing values (if any)
-            df.to_csv("results.csv")
+            # Optional debugging dump, written off the event loop
+            if save_csv:
+                await asyncio.to_thread(df.to_csv, "results.csv")
             return df
 
     except Exception as e:
         print(f"Error during data retrieval: {e}")
         return pd.DataFrame()
     finally:
-        await pool.close()
-
-
-
-
+        if owns_pool:
+            await active_pool.close()
 
+async def stream_data(words, min_play_count=50000, min_comment_likes=5, batch_size=5000, after=None):
+    # Same rows as get_data, yielded as DataFrames of at most batch_size
+    # records read through a server-side cursor, so memory is bounded by the
+    # batch rather than the full join result. With after (a post id as
+    # returned in post_id) only posts with a greater id are read.
+    owns_pool = pool is None
+    active_pool = await create_pool() if owns_pool else pool
+    try:
+        start = time.perf_counter()
+        async with active_pool.acquire() as connection:
+            record_timing('wait', time.perf_counter() - start)
+            if after is None:
+                query, args = HASHTAG_QUERY, (words, min_play_count, min_comment_likes)
+            else:
+                query, args = NEW_POSTS_QUERY, (words, min_play_count, min_comment_likes, after)
+            # Server-side cursors only live inside a transaction
+            async with connection.transaction():
+                cursor = await connection.cursor(query, *args)
+                while True:
+                    start = time.perf_counter()
+                    records = await cursor.fetch(batch_size)
+                    record_timing('query', time.perf_counter() - start)
+                    if not records:
+                        break
+                    yield records_to_frame(records, list(records[0].keys()))
+                    if len(records) < batch_size:
+                        break
+    except Exception as e:
+        print(f"Error during data streaming: {e}")
+        raise
+    finally:
+        if owns_pool:
+            await active_pool.close()
@@ -0,0 +1,137 @@
+import time, threading, contextvars
+from contextlib import contextmanager
+
+# Minimal Prometheus-style metrics: counters and histograms with labels,
+# rendered in the text exposition format by render(). Everything lives in
+# process memory; each uvicorn worker exposes its own numbers.
+
+# Per-request stage timings (stage -> seconds) for the Server-Timing header
+request_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+def format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (extra or [])
+    if not pairs:
+        return ''
+    escaped = [(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in pairs]
+    return '{' + ','.join(f'{k}="{v}"' for k, v in escaped) + '}'
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{format_labels(self.labelnames, key)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            counts, total, count = self.values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[key] = (counts, total + value, count + 1)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, (counts, total, count) in sorted(self.values.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{format_labels(self.labelnames, key, [("le", bound)])} {bucket_count}')
+                lines.append(f'{self.name}_bucket{format_labels(self.labelnames, key, [("le", "+Inf")])} {count}')
+                lines.append(f'{self.name}_sum{format_labels(self.labelnames, key)} {total}')
+                lines.append(f'{self.name}_count{format_labels(self.labelnames, key)} {count}')
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    'scenario_stage_duration_seconds', 'Duration of /generate pipeline stages.', ['stage']
+)
+STAGE_ITEMS = Histogram(
+    'scenario_stage_items', 'Rows, chunks, matches or contexts handled by a pipeline stage per request.',
+    ['stage', 'kind'], buckets=(1, 10, 100, 1000, 10000, 100000, 1000000, 10000000)
+)
+TOKENS = Counter(
+    'scenario_tokens_total', 'Tokens sent to or generated by external models.', ['model', 'kind']
+)
+RETRIES = Counter(
+    'scenario_external_retries_total', 'Retries of external calls after a failed attempt.', ['service']
+)
+
+METRICS = [STAGE_SECONDS, STAGE_ITEMS, TOKENS, RETRIES]
+# Callables returning [(name, help, {label tuple: value})] rendered as gauges
+collectors = []
+
+
+@contextmanager
+def stage(name):
+    # Times a block into the stage histogram and the per-request timings
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+def record_stage(name, seconds):
+    STAGE_SECONDS.observe(seconds, stage=name)
+    timings = request_timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+def record_items(stage_name, kind, count):
+    STAGE_ITEMS.observe(count, stage=stage_name, kind=kind)
+
+
+def record_tokens(model, kind, count):
+    if count:
+        TOKENS.inc(count, model=model, kind=kind)
+
+
+def retry_handler(service):
+    # on_backoff handler for backoff.on_exception
+    def handler(details):
+        RETRIES.inc(service=service)
+    return handler
+
+
+def server_timing(timings):
+    return ', '.join(f'{name};dur={seconds * 1000:.1f}' for name, seconds in timings.items())
+
+
+def render():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    for collector in collectors:
+        for name, documentation, samples in collector():
+            lines.append(f'# HELP {name} {documentation}')
+            lines.append(f'# TYPE {name} gauge')
+            for labels, value in samples.items():
+                lines.append(f'{name}{format_labels([k for k, _ in labels], [v for _, v in labels])} {value}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,242 @@
+import os, time, sqlite3, threading, asyncio, argparse
+import pandas as pd
+from dotenv import load_dotenv
+from utils.db import stream_data, init_pool, close_pool
+from rag.chunk import ChunkBuilder, upsert_embeddings_to_pinecone
+from rag.dedup import collapse_near_duplicates
+from utils.utils import filter_languages
+
+load_dotenv()
+
+# Offline ingestion worker. On a schedule it pulls posts newer than each
+# tracked hashtag's watermark, chunks them, embeds and upserts only new
+# content, and keeps the hashtag's full chunk table on disk. Every
+# FULL_REFRESH_INTERVAL it streams the whole hashtag again instead. /generate loads
+# that table for precomputed hashtags instead of hitting Postgres and the
+# embedding API on the request path.
+#
+#   python -m utils.offline_task --hashtags bag tote --interval 3600
+#
+INGEST_DIR = os.getenv('INGEST_DIR', '.cache/ingest')
+TRACKED_HASHTAGS = [h.strip() for h in os.getenv('TRACKED_HASHTAGS', '').split(',') if h.strip()]
+# Seconds between runs; 0 runs once and exits
+INGEST_INTERVAL = float(os.getenv('INGEST_INTERVAL', '3600'))
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', '5000'))
+# Seconds between full re-streams of a hashtag. The watermark only moves
+# with new posts, so comments, replies and likes added to older posts (and
+# posts scraped late) are only picked up by these; the upsert manifest keeps
+# them to re-embedding the chunks that actually changed.
+FULL_REFRESH_INTERVAL = float(os.getenv('FULL_REFRESH_INTERVAL', str(6 * 3600)))
+# Precomputed chunks not fully refreshed within this many seconds are ignored
+# by /generate; 0 disables them
+PRECOMPUTED_MAX_AGE = float(os.getenv('PRECOMPUTED_MAX_AGE', str(24 * 3600)))
+
+
+class IngestState:
+    # Per-hashtag watermark: the greatest post id ingested so far, how many
+    # chunks the hashtag has, when it was last ingested (updated_at) and when
+    # it was last streamed in full (refreshed_at). post_id keeps
+    # the type the database returned (no column affinity), so it can be
+    # bound straight back into the new-posts query.
+    def __init__(self, path=None):
+        path = path or os.path.join(INGEST_DIR, 'state.sqlite')
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS watermarks (
+                hashtag TEXT PRIMARY KEY,
+                post_id,
+                chunks INTEGER,
+                updated_at REAL,
+                refreshed_at REAL
+            )
+        ''')
+        columns = {row[1] for row in self._conn.execute('PRAGMA table_info(watermarks)')}
+        if 'refreshed_at' not in columns:
+            self._conn.execute('ALTER TABLE watermarks ADD COLUMN refreshed_at REAL')
+        self._conn.commit()
+
+    def get(self, hashtag):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT post_id, chunks, updated_at, refreshed_at FROM watermarks WHERE hashtag = ?', (hashtag,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {'post_id': row[0], 'chunks': row[1], 'updated_at': row[2], 'refreshed_at': row[3]}
+
+    def set(self, hashtag, post_id, chunks, refreshed_at):
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO watermarks (hashtag, post_id, chunks, updated_at, refreshed_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (hashtag, post_id, chunks, time.time(), refreshed_at)
+            )
+            self._conn.commit()
+
+    def all(self):
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT hashtag, post_id, chunks, updated_at, refreshed_at FROM watermarks'
+            ).fetchall()
+        return {h: {'post_id': p, 'chunks': c, 'updated_at': u, 'refreshed_at': r} for h, p, c, u, r in rows}
+
+
+def chunks_path(hashtag):
+    safe = ''.join(ch if ch.isalnum() or ch in '-_' else '_' for ch in hashtag)
+    return os.path.join(INGEST_DIR, 'chunks', f'{safe}.pkl')
+
+
+def read_chunks(hashtag):
+    path = chunks_path(hashtag)
+    if not os.path.exists(path):
+        return None
+    return pd.read_pickle(path)
+
+
+def write_chunks(hashtag, chunks_df):
+    path = chunks_path(hashtag)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    chunks_df.to_pickle(tmp)
+    os.replace(tmp, path)
+
+
+# Chunk tables already read by this process: path -> (mtime, DataFrame)
+loaded_chunks = {}
+state = None
+
+
+def get_state():
+    global state
+    if state is None:
+        state = IngestState()
+    return state
+
+
+def load_precomputed(hashtags, max_age=None):
+    # Chunks for hashtags as prepared by the worker, or None unless every
+    # hashtag has been streamed in full within max_age seconds.
+    max_age = PRECOMPUTED_MAX_AGE if max_age is None else max_age
+    hashtags = sorted({h.strip() for h in hashtags or [] if h.strip()})
+    if not hashtags or not max_age:
+        return None
+    parts = []
+    for hashtag in hashtags:
+        record = get_state().get(hashtag)
+        path = chunks_path(hashtag)
+        refreshed_at = record and record['refreshed_at']
+        if not refreshed_at or time.time() - refreshed_at > max_age or not os.path.exists(path):
+            return None
+        mtime = os.path.getmtime(path)
+        cached = loaded_chunks.get(path)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, pd.read_pickle(path))
+            loaded_chunks[path] = cached
+        parts.append(cached[1])
+    chunks_df = pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0]
+    return chunks_df.drop_duplicates('chunk_id').reset_index(drop=True).copy()
+
+
+async def ingest_hashtag(hashtag, store=None, full=False, batch_size=None):
+    # Pulls posts newer than the hashtag's watermark, upserts their chunks and
+    # merges them into the stored chunk table. With full, or once the last
+    # full run is FULL_REFRESH_INTERVAL old, every post is streamed and the
+    # table rebuilt. The watermark only moves after the upsert and the table
+    # write succeed, so a failed run is retried from the same point on the
+    # next one.
+    ingest_state = get_state()
+    record = ingest_state.get(hashtag)
+    started = time.time()
+    refreshed_at = record and record['refreshed_at']
+    full = full or not refreshed_at or started - refreshed_at >= FULL_REFRESH_INTERVAL
+    after = None if full else record['post_id']
+
+    builder = ChunkBuilder()
+    latest, rows = after, 0
+    async for batch in stream_data([hashtag], batch_size=batch_size or INGEST_BATCH_SIZE, after=after):
+        # Before add(), which turns post ids into strings
+        newest = max(batch['post_id'].tolist())
+        latest = newest if latest is None else max(latest, newest)
+        await asyncio.to_thread(builder.add, batch)
+        rows += len(batch)
+
+    if not rows:
+        # Nothing new. A full run that finds no posts at all does not count
+        # as a refresh, so a table that can't be rebuilt goes stale.
+        if record is not None:
+            ingest_state.set(hashtag, record['post_id'], record['chunks'], record['refreshed_at'])
+        chunks = record['chunks'] if record is not None else 0
+        return {'hashtag': hashtag, 'full': full, 'rows': 0, 'chunks': chunks, 'upserted': 0, 'deleted': 0}
+
+    new_chunks = await asyncio.to_thread(lambda: filter_languages(builder.result()))
+    # Near-duplicates are collapsed within each run's new chunks
+    new_chunks = await asyncio.to_thread(collapse_near_duplicates, new_chunks)
+    # With full, chunks of this hashtag that disappeared are pruned
+    counts = await upsert_embeddings_to_pinecone(new_chunks, store=store, scope=hashtag, prune=full, hashtags=[hashtag])
+    existing = None if full else await asyncio.to_thread(read_chunks, hashtag)
+    if existing is not None:
+        new_chunks = pd.concat([existing, new_chunks], ignore_index=True).drop_duplicates('chunk_id', keep='last')
+    await asyncio.to_thread(write_chunks, hashtag, new_chunks)
+    ingest_state.set(hashtag, latest, len(new_chunks), started if full else refreshed_at)
+    return {'hashtag': hashtag, 'full': full, 'rows': rows, 'chunks': len(new_chunks), 'upserted': counts['upserted'], 'deleted': counts['deleted']}
+
+
+async def run_once(hashtags, store=None, full=False):
+    results = []
+    for hashtag in hashtags:
+        start = time.perf_counter()
+        try:
+            result = await ingest_hashtag(hashtag, store=store, full=full)
+        except Exception as e:
+            print(f"Ingestion of {hashtag} failed: {e}")
+            continue
+        result['seconds'] = round(time.perf_counter() - start, 3)
+        print(f"Ingested {result}")
+        results.append(result)
+    return results
+
+
+async def run_forever(hashtags, interval, full=False):
+    # full only applies to the first run; later runs are incremental until a
+    # hashtag is due for its periodic full refresh
+    await init_pool()
+    try:
+        while True:
+            start = time.monotonic()
+            await run_once(hashtags, full=full)
+            full = False
+            if not interval:
+                break
+            await asyncio.sleep(max(0.0, interval - (time.monotonic() - start)))
+    finally:
+        await close_pool()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute chunks and embeddings for tracked hashtags.")
+    parser.add_argument('--hashtags', nargs='+', default=TRACKED_HASHTAGS,
+                        help="hashtags to ingest (default: TRACKED_HASHTAGS)")
+    parser.add_argument('--interval', type=float, default=INGEST_INTERVAL,
+                        help="seconds between runs, 0 to run once (default: INGEST_INTERVAL)")
+    parser.add_argument('--full', action='store_true',
+                        help="ignore watermarks and rebuild each hashtag, pruning removed chunks")
+    parser.add_argument('--status', action='store_true', help="print the watermarks and exit")
+    args = parser.parse_args()
+
+    if args.status:
+        for hashtag, record in sorted(get_state().all().items()):
+            age = time.time() - record['updated_at']
+            refreshed = f"{time.time() - record['refreshed_at']:.0f}s" if record['refreshed_at'] else 'never'
+            print(f"{hashtag}: post_id={record['post_id']} chunks={record['chunks']} age={age:.0f}s refreshed={refreshed}")
+        return
+    if not args.hashtags:
+        parser.error("no hashtags given and TRACKED_HASHTAGS is empty")
+    asyncio.run(run_forever(args.hashtags, args.interval, args.full))
+
+
+if __name__ == '__main__':
+    main()
@@ -23,7 +23,7 @@ Your task is to generate similarly deep, emotionally resonant scenarios based on
 
 
 ## reivew Data Structure
-The input data is a list of text sorted by the number of likes and relevance to keyword in descending order. 
+The input data is a tree of posts, comments and replies. Each line is "- [level | likes] text", and comments and replies are indented under the post or comment they respond to, so every post or comment appears only once. Posts and their children are ordered by the number of likes and relevance to keyword in descending order. 
 
 ## Input:
 <keyword> {keyword} </keyword>
@@ -108,6 +108,29 @@ write down your thoughts in <relfections >and revise the scenarios based on your
 
 
 
+SHARD_PROMPT = """
+You are an expert AI assistant specializing in content strategy and market analysis. You are given one shard of a larger dataset of TikTok posts, comments and replies about a product keyword. Other analysts are reading the other shards, and a final step will merge everyone's findings into product usage scenarios for TikTok content creation.
+
+## Input:
+<keyword> {keyword} </keyword>
+
+<review>
+{reviews}
+</review>
+
+The review data is a tree: each line is "- [level | likes] text", and comments and replies are indented under the post or comment they respond to.
+
+Extract the pain points, needs, desires and recurring themes in this shard that relate to the <keyword>. For each one, give:
+- THEME: a short name
+- WHO / WHAT / WHERE: the user persona, the need or desire, and the situation, when the data shows them
+- FREQUENCY: roughly how many texts mention it, and their combined likes
+- EVIDENCE: 2-4 short quotes from the data
+- EMOTION: the underlying emotion or motivation
+
+List the findings from most to least important, weighting by frequency and likes. Only report what is supported by the data in this shard; do not write scenarios yet.
+"""
+
+
 SUMMARY_GUIDE = '''
 Context: We are developing a good AI assistant that can help users to generate scenarios for TikTok content creation for product selling based on a large dataset of social media interactions.
 - You are an expert AI assistant having perfect skills in summarizing user's query and clarifies a series of questions that user is asking or may want to ask. 
@@ -179,4 +202,11 @@ Based on the above instructions and example hashtags, generate up to 10 high-qua
 Provide the list of queries in the specified format.
 
 
-'''
\ No newline at end of file
+'''
+
+# Reduce step of map-reduce generation: same task and output format as
+# PROMPT, but the review slot holds the findings extracted per shard.
+REDUCE_PROMPT = PROMPT.replace(
+    '''The input data is a tree of posts, comments and replies. Each line is "- [level | likes] text", and comments and replies are indented under the post or comment they respond to, so every post or comment appears only once. Posts and their children are ordered by the number of likes and relevance to keyword in descending order. ''',
+    '''The input data is a set of findings written by analysts who each read a different shard of the posts, comments and replies. Each finding lists a theme, the persona/need/situation behind it, its frequency and likes, and quoted evidence. Themes reported by several shards are discussed more widely and carry more weight. '''
+)
@@ -0,0 +1,20 @@
+import asyncio
+
+
+class SingleFlight:
+    # Coalesces concurrent calls with the same key onto one in-flight task.
+    # Every caller gets the same result (or exception); a caller that is
+    # cancelled does not cancel the shared task for the others.
+    def __init__(self):
+        self.inflight = {}
+
+    async def do(self, key, fn):
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self.inflight[key] = task
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    def __len__(self):
+        return len(self.inflight)
@@ -0,0 +1,23 @@
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text, model="gpt-4o-2024-05-13"):
+    # Exact count with tiktoken when it is installed, otherwise the usual
+    # ~4 characters per token estimate (rounded up).
+    text = str(text)
+    if tiktoken is None:
+        return len(text) // 4 + 1
+    return len(get_encoding(model).encode(text, disallowed_special=()))
@@ -1,45 +1,132 @@
 import openai
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 import numpy as np
 import json
+import os
+import hashlib
+import unicodedata
 import asyncio
 from collections import defaultdict, Counter
 from typing import List, Dict, Tuple
-from langdetect import detect, LangDetectException
+from langdetect import detect, DetectorFactory, LangDetectException
 from deep_translator import GoogleTranslator
 import emoji
 import re
 import spacy
+import multiprocessing
 from concurrent.futures import ProcessPoolExecutor, as_completed
+from utils.cache import DiskCache
 
 
-# Load a small spaCy model for efficient processing
-nlp = spacy.load("en_core_web_sm", disable=["ner", "textcat"])
+# Small spaCy model, loaded once per process on first use. The rules below
+# only read part-of-speech tags (tagger + attribute_ruler) and dependency
+# labels (parser), so every other component is left out.
+NLP_MODEL = os.getenv("SPACY_MODEL", "en_core_web_sm")
+NLP_COMPONENTS = {"tok2vec", "tagger", "attribute_ruler", "parser"}
+NLP_BATCH_SIZE = 256
+nlp = None
 
 # Set a larger cache size for language detection
 CACHE_SIZE = 1000000
 
-def is_meaningful_comment(comment: str) -> bool:
+# Languages kept by the language filter, comma separated ISO 639-1 codes
+# (ALLOWED_LANGUAGES= disables it). Text with no detectable language, such as
+# emoji-only comments, is always kept and left to the quality filter.
+ALLOWED_LANGUAGES = {code.strip() for code in os.getenv('ALLOWED_LANGUAGES', 'en').split(',') if code.strip()}
+UNDETERMINED = 'und'
+# Distinct texts per worker task when detection runs on the pool
+LANGID_BATCH_SIZE = 2000
+# Bump whenever the detection rules change
+LANGID_VERSION = 1
+# langdetect is randomized; a fixed seed makes its answers (and the cache) stable
+DetectorFactory.seed = 0
+
+# Texts written mostly in these scripts are answered from the script alone
+SCRIPT_LANGUAGES = {
+    'HIRAGANA': 'ja', 'KATAKANA': 'ja', 'HANGUL': 'ko', 'CJK': 'zh',
+    'CYRILLIC': 'ru', 'ARABIC': 'ar', 'HEBREW': 'he', 'GREEK': 'el',
+    'THAI': 'th', 'DEVANAGARI': 'hi', 'BENGALI': 'bn', 'TAMIL': 'ta',
+}
+# Function words of other languages that are often written in plain ASCII;
+# ASCII text without any of them skips the detector
+FOREIGN_WORDS = {
+    "el", "los", "las", "una", "es", "por", "para", "pero", "muy", "donde", "que", "como", "esta",
+    "le", "les", "des", "est", "et", "je", "pour", "avec", "pas", "tres", "ce", "du", "au",
+    "der", "die", "das", "und", "ist", "nicht", "ich", "mit", "ein", "eine", "sehr",
+    "il", "di", "che", "della", "sono", "molto", "em", "um", "uma", "voce", "muito", "nao",
+    "yang", "dan", "ini", "itu", "aku", "ada", "het", "een", "ik", "niet", "og", "jeg",
+}
+
+# Comment verdicts keyed by normalized text, shared by every worker process
+# through sqlite and kept across runs (COMMENT_CACHE_PATH= disables it).
+# Bump CLASSIFIER_VERSION whenever the rules change.
+COMMENT_CACHE_PATH = os.getenv('COMMENT_CACHE_PATH', '.cache/comments.sqlite')
+CLASSIFIER_VERSION = 1
+comment_cache = None
+comment_cache_pid = None
+# Comments answered from the cache (or by an identical comment in the same
+# batch) versus classified, summed over this process and its workers
+COMMENT_CACHE_STATS = {'hits': 0, 'misses': 0}
+
+# List of generic, low-information phrases
+GENERIC_PHRASES = {"this is great", "love it", "awesome", "nice", "cool", "good"}
+
+def get_nlp():
+    global nlp
+    if nlp is None:
+        nlp = spacy.load(NLP_MODEL, exclude=["ner", "lemmatizer", "textcat", "senter"])
+        nlp.select_pipes(enable=[name for name in nlp.pipe_names if name in NLP_COMPONENTS])
+    return nlp
+
+def get_comment_cache():
+    # One connection per process: a sqlite handle must not cross a fork
+    global comment_cache, comment_cache_pid
+    if not COMMENT_CACHE_PATH:
+        return None
+    if comment_cache is None or comment_cache_pid != os.getpid():
+        comment_cache = DiskCache(COMMENT_CACHE_PATH, max_entries=CACHE_SIZE)
+        comment_cache_pid = os.getpid()
+    return comment_cache
+
+def get_comment_cache_stats():
+    cache = get_comment_cache()
+    if cache is None:
+        return {}
+    stats = dict(COMMENT_CACHE_STATS)
+    total = stats['hits'] + stats['misses']
+    stats['hit_rate'] = stats['hits'] / total if total else 0.0
+    stats['entries'] = cache.stats()['entries']
+    return stats
+
+def normalize_comment(comment: str) -> str:
+    # Case, Unicode compatibility forms and whitespace don't change the verdict
+    return ' '.join(unicodedata.normalize('NFKC', comment).casefold().split())
+
+def comment_key(normalized: str) -> str:
+    digest = hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+    return f"{CLASSIFIER_VERSION}:{NLP_MODEL}:{digest}"
+
+def prefilter_comment(comment: str):
+    # Cheap rejects that need no parse. Returns the emoji-free text to
+    # analyse, or None when the comment is rejected outright.
+    if not comment:
+        return None
+
     # Remove emojis for text analysis
     text_without_emoji = emoji.replace_emoji(comment, replace='')
     
     # Check if the comment is primarily emojis
     if len(text_without_emoji.strip()) / len(comment) < 0.2:
-        return False
+        return None
     
     # Check comment length
     if len(text_without_emoji.split()) < 2:
-        return False
-    
-    # List of generic, low-information phrases
-    generic_phrases = {"this is great", "love it", "awesome", "nice", "cool", "good"}
-    if text_without_emoji.lower().strip() in generic_phrases:
-        return False
-    
-    # Use spaCy for linguistic analysis
-    doc = nlp(text_without_emoji)
+        return None
     
+    if text_without_emoji.lower().strip() in GENERIC_PHRASES:
+        return None
+    return text_without_emoji
+
+def is_meaningful_doc(doc) -> bool:
     # Check for presence of verb
     has_verb = any(token.pos_ == "VERB" for token in doc)
     
@@ -58,10 +145,151 @@ def is_meaningful_comment(comment: str) -> bool:
     
     return is_meaningful
 
+def is_meaningful_comment(comment: str) -> bool:
+    text = prefilter_comment(comment)
+    if text is None:
+        return False
+    # Use spaCy for linguistic analysis
+    return is_meaningful_doc(get_nlp()(text))
+
+def classify_uncached(comments: List[str]) -> List[bool]:
+    # is_meaningful_comment for many comments: the cheap rejects run first
+    # and only the survivors are parsed, in batches through nlp.pipe
+    results = [False] * len(comments)
+    survivors = []
+    for i, comment in enumerate(comments):
+        text = prefilter_comment(comment)
+        if text is not None:
+            survivors.append((i, text))
+    docs = get_nlp().pipe((text for _, text in survivors), batch_size=NLP_BATCH_SIZE)
+    for (i, _), doc in zip(survivors, docs):
+        results[i] = is_meaningful_doc(doc)
+    return results
+
+def classify_comments(comments: List[str], use_cache: bool = True) -> List[bool]:
+    # Each distinct normalized text is classified once per call, and only if
+    # the comment cache doesn't already hold its verdict
+    results = [False] * len(comments)
+    groups = {}
+    for i, comment in enumerate(comments):
+        if isinstance(comment, str) and comment:
+            groups.setdefault(comment_key(normalize_comment(comment)), []).append(i)
+
+    cache = get_comment_cache() if use_cache else None
+    cached = cache.get_many(list(groups)) if cache is not None else {}
+    missing = [key for key in groups if key not in cached]
+    verdicts = dict(zip(missing, classify_uncached([comments[groups[key][0]] for key in missing])))
+    if cache is not None and verdicts:
+        cache.set_many({key: b'1' if verdict else b'0' for key, verdict in verdicts.items()})
+
+    for key, indices in groups.items():
+        verdict = verdicts[key] if key in verdicts else cached[key] == b'1'
+        for i in indices:
+            results[i] = verdict
+    COMMENT_CACHE_STATS['misses'] += len(missing)
+    COMMENT_CACHE_STATS['hits'] += sum(len(indices) for indices in groups.values()) - len(missing)
+    return results
+
+def language_key(normalized: str) -> str:
+    digest = hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+    return f"lang:{LANGID_VERSION}:{digest}"
+
+def script_language(text: str):
+    # Language implied by the writing system alone, or None when the text
+    # has to go to the detector. Latin text without diacritics is taken as
+    # English unless it has foreign function words: a wrong guess here only
+    # keeps a comment, while a wrong drop would lose it.
+    letters = [ch for ch in text if ch.isalpha()]
+    if not letters:
+        return UNDETERMINED
+    if all(ch < '\x80' for ch in letters):
+        words = re.findall(r"[a-z']+", text.lower())
+        if len(words) <= 3 or not FOREIGN_WORDS.intersection(words):
+            return 'en'
+        return None
+    scripts = Counter(unicodedata.name(ch, 'UNKNOWN').split(' ')[0] for ch in letters)
+    if scripts['LATIN'] * 2 >= len(letters):
+        return None
+    # Japanese mixes kanji with kana; any kana decides it
+    if scripts['HIRAGANA'] or scripts['KATAKANA']:
+        return 'ja'
+    script = scripts.most_common(1)[0][0]
+    return SCRIPT_LANGUAGES.get(script, UNDETERMINED)
+
+def detect_language_uncached(text: str) -> str:
+    text = emoji.replace_emoji(text or '', replace=' ')
+    language = script_language(text)
+    if language is not None:
+        return language
+    try:
+        return detect(text).split('-')[0]
+    except LangDetectException:
+        return UNDETERMINED
+
+def detect_languages_uncached(texts: List[str]) -> List[str]:
+    return [detect_language_uncached(text) for text in texts]
+
+def detect_languages(texts: List[str], use_cache: bool = True, max_workers: int = None) -> List[str]:
+    # Language of each text. Identical texts (after normalization) are
+    # detected once and answers are kept in the comment cache under "lang:"
+    # keys. With max_workers other than 1, large sets of uncached texts are
+    # spread over the language detection pool.
+    groups = {}
+    for i, text in enumerate(texts):
+        groups.setdefault(language_key(normalize_comment(text or '')), []).append(i)
+
+    cache = get_comment_cache() if use_cache else None
+    cached = cache.get_many(list(groups)) if cache is not None else {}
+    missing = [key for key in groups if key not in cached]
+    missing_texts = [texts[groups[key][0]] or '' for key in missing]
+    if max_workers != 1 and len(missing_texts) > LANGID_BATCH_SIZE:
+        executor = get_langid_executor(max_workers)
+        batches = [missing_texts[i:i + LANGID_BATCH_SIZE] for i in range(0, len(missing_texts), LANGID_BATCH_SIZE)]
+        detected = [language for languages in executor.map(detect_languages_uncached, batches) for language in languages]
+    else:
+        detected = detect_languages_uncached(missing_texts)
+    languages = dict(zip(missing, detected))
+    if cache is not None and languages:
+        cache.set_many({key: language.encode('ascii') for key, language in languages.items()})
+
+    results = [UNDETERMINED] * len(texts)
+    for key, indices in groups.items():
+        language = languages[key] if key in languages else cached[key].decode('ascii')
+        for i in indices:
+            results[i] = language
+    return results
+
+def language_allowed(language: str) -> bool:
+    return not ALLOWED_LANGUAGES or language == UNDETERMINED or language in ALLOWED_LANGUAGES
+
+def filter_languages(chunks_df, max_workers: int = None):
+    # Drops comment and reply chunks in languages outside ALLOWED_LANGUAGES
+    # before they are embedded or reach a prompt. Posts are kept so the
+    # remaining comments still have their context.
+    if not ALLOWED_LANGUAGES or chunks_df.empty:
+        return chunks_df
+    candidates = chunks_df.index[chunks_df['level'] != 'post']
+    languages = detect_languages(chunks_df.loc[candidates, 'text'].astype(str).tolist(), max_workers=max_workers)
+    dropped = [index for index, language in zip(candidates, languages) if not language_allowed(language)]
+    if not dropped:
+        return chunks_df
+    return chunks_df.drop(index=dropped)
+
+def process_text_batch_with_stats(texts):
+    # process_text_batch for pool workers: also returns the worker's cache
+    # hits and misses for this batch so the parent can aggregate them
+    before = dict(COMMENT_CACHE_STATS)
+    processed_texts = process_text_batch(texts)
+    return processed_texts, {k: COMMENT_CACHE_STATS[k] - before[k] for k in before}
+
 def process_text_batch(texts: List[Tuple[str, str, str, str, int]]) -> List[Dict[str, str]]:
     processed_texts = []
-    for id, parent_id, text_type, text, likes in texts:  # Include 'likes' in the unpacking
-        if is_meaningful_comment(text):
+    # Unwanted languages never reach spaCy; posts are always kept
+    languages = detect_languages([text for _, _, _, text, _ in texts], max_workers=1)
+    texts = [item for item, language in zip(texts, languages) if item[2] == 'post' or language_allowed(language)]
+    keep = classify_comments([text for _, _, _, text, _ in texts])
+    for (id, parent_id, text_type, text, likes), meaningful in zip(texts, keep):  # Include 'likes' in the unpacking
+        if meaningful:
             processed_texts.append({
                 'id': id,
                 'parent_id': parent_id,
@@ -71,6 +299,34 @@ def process_text_batch(texts: List[Tuple[str, str, str, str, int]]) -> List[Dict
             })
     return processed_texts
 
+# Worker pools kept alive across preprocess_tiktok_data calls, keyed by
+# max_workers; each worker loads spaCy once in its initializer
+executors = {}
+
+def get_executor(max_workers=None):
+    if max_workers not in executors:
+        executors[max_workers] = ProcessPoolExecutor(max_workers=max_workers, initializer=get_nlp)
+    return executors[max_workers]
+
+# Language detection pools, keyed by max_workers. Workers only need
+# langdetect, so there is no spaCy initializer, and they are spawned rather
+# than forked since the API process calling filter_languages runs threads
+# and an event loop.
+langid_executors = {}
+
+def get_langid_executor(max_workers=None):
+    if max_workers not in langid_executors:
+        langid_executors[max_workers] = ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')
+        )
+    return langid_executors[max_workers]
+
+def shutdown_executors():
+    for pools in (executors, langid_executors):
+        for executor in pools.values():
+            executor.shutdown(cancel_futures=True)
+        pools.clear()
+
 def preprocess_tiktok_data(data: Dict[str, Dict], batch_size: int = 1000, max_workers: int = None) -> Dict[str, Dict]:
     all_texts = []
     
@@ -90,11 +346,19 @@ def preprocess_tiktok_data(data: Dict[str, Dict], batch_size: int = 1000, max_wo
     
     processed_texts = []
     
-    # Process batches in parallel
-    with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        future_to_batch = {executor.submit(process_text_batch, batch): batch for batch in batches}
+    if len(batches) <= 1 or max_workers == 1:
+        # Not worth a round trip to the worker pool
+        for batch in batches:
+            processed_texts.extend(process_text_batch(batch))
+    else:
+        # Process batches in parallel on the persistent pool
+        executor = get_executor(max_workers)
+        future_to_batch = {executor.submit(process_text_batch_with_stats, batch): batch for batch in batches}
         for future in as_completed(future_to_batch):
-            processed_texts.extend(future.result())
+            batch_texts, stats = future.result()
+            processed_texts.extend(batch_texts)
+            for k, v in stats.items():
+                COMMENT_CACHE_STATS[k] += v
     
     # Reconstruct the nested structure with filtered texts and include likes
     filtered_data = defaultdict(lambda: {
@@ -164,4 +428,62 @@ def extract_json_from_text(text):
             return None
     else:
         print("No JSON found in the text")
-        return None
\ No newline at end of file
+        return None
+
+class JSONArrayStreamParser:
+    # Incremental counterpart of extract_json_from_text for streamed output:
+    # feed() text deltas and get back each top-level object of the first
+    # ```json array as soon as its closing brace has arrived.
+    def __init__(self):
+        self.buffer = ''
+        self.start = None      # offset of the json block body in buffer
+        self.pos = 0           # next offset to scan
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.object_start = None
+        self.done = False
+
+    def feed(self, text):
+        self.buffer += text
+        objects = []
+        if self.done:
+            return objects
+        if self.start is None:
+            match = re.search(r'```json\n', self.buffer)
+            if not match:
+                return objects
+            self.start = self.pos = match.end()
+
+        while self.pos < len(self.buffer):
+            char = self.buffer[self.pos]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == '\\':
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in '[{':
+                self.depth += 1
+                if char == '{' and self.depth == 2:
+                    self.object_start = self.pos
+            elif char in ']}':
+                self.depth -= 1
+                if char == '}' and self.depth == 1 and self.object_start is not None:
+                    try:
+                        objects.append(json.loads(self.buffer[self.object_start:self.pos + 1]))
+                    except json.JSONDecodeError as e:
+                        print(f"Error decoding streamed JSON object: {e}")
+                    self.object_start = None
+                elif self.depth <= 0:
+                    self.done = True
+                    self.pos += 1
+                    break
+            elif char == '`' and self.depth == 0:
+                self.done = True
+                break
+            self.pos += 1
+        return objects
@@ -1,7 +1,8 @@
 from utils.db import get_data
 from utils.chat import get_response_from_llm
 from utils.utils import preprocess_tiktok_data, analyze_hashtags, extract_json_from_text
-from rag.chunk import create_chunks_from_df, upsert_embeddings_to_pinecone, query_pinecone, rerank_results, get_full_contexts
+from rag.chunk import create_chunks_from_df, upsert_embeddings_to_pinecone, query_pinecone, rerank_union, log_normalized_likes, ParentIndex
+from rag.pack import pack_contexts
 from utils.prompts import PROMPT,SUMMARY_GUIDE
 import openai, json, asyncio, os, re, ast
 import os.path as osp
@@ -94,13 +95,13 @@ def generate():
     "#ShoulderBag", "#CanvasBag","quality bags", "latest bag trends", "handbag", "tote bag"]
 
     # Step 0: Get data from postgres
-    raw_data = asyncio.run(get_data(input_hashtags))
+    raw_data = asyncio.run(get_data(input_hashtags, save_csv=True))
     breakpoint()
     #Step 1: Create chunks
     chunks_df = create_chunks_from_df(raw_data)
     chunks_df = pd.read_csv("results.csv")
     #add normalized likes for final accumulated score calculation
-    chunks_df['normalized_likes'] = (chunks_df['likes'] - chunks_df['likes'].min()) / (chunks_df['likes'].max() - chunks_df['likes'].min())
+    chunks_df['normalized_likes'] = log_normalized_likes(chunks_df['likes'])
 
     # Step 2: Upsert embeddings to Pinecone
     upsert_embeddings_to_pinecone(chunks_df)
@@ -111,18 +112,14 @@ def generate():
     print(query_text)
     results = asyncio.run(query_pinecone(query_text, top_k=400))
     
-    # Step 4: Rerank results
-    merged_df = pd.DataFrame()
-    for res in results:
-        results_df = rerank_results(res)
-        # Step 5: Reconstruct full contexts
-        results_df = get_full_contexts(results_df, chunks_df)
-        merged_df = pd.concat([merged_df, results_df])
-    merged_df = merged_df.drop_duplicates(subset=['chunk_id'], keep='first')
-    merged_df = merged_df.sort_values(by='combined_score', ascending=False)
+    # Step 4: Rerank the matches of every query together
+    # Step 5: Reconstruct full contexts for the top chunks
+    parent_index = ParentIndex(chunks_df)
+    merged_df = rerank_union(results, chunks_df, parent_index, top_n=1000)
     merged_df.to_csv('merge.csv')
     
-    results = generate_scenarios("./", merged_df['full_context'], keyword, client, client_model)
+    reviews, context_tokens = pack_contexts(merged_df, parent_index)
+    results = generate_scenarios("./", reviews, keyword, client, client_model)
     print(results)
     
     scenarios = extract_json_from_text(results)